@@ -4,13 +4,46 @@ from flask_caching import Cache
 app = dash.Dash(__name__)
 # Neeeded for callbacks using dynamically generated ui components
 app.config.suppress_callback_exceptions = True
-# configure cache
-"""cache = Cache(app.server, config={
-    'CACHE_TYPE': 'filesystem',
-    'CACHE_DIR': 'cache-directory',
-    'CACHE_THRESHOLD': '100'
-}) """
 
 CACHE_TIMEOUT_S = 120
 # relative path for dataset directory
 DATASETS_PATH = './datasets/'
+# upper bounds for the in-process cache of parsed datasets
+DATASET_CACHE_ENTRIES = 16
+DATASET_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# ... and of validated/normalized/power transformed copies of them
+DERIVED_CACHE_ENTRIES = 32
+DERIVED_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# derived on-disk artefacts (columnar copies of datasets etc.)
+CACHE_PATH = './cache-directory/'
+SIDECAR_PATH = './cache-directory/columnar/'
+# metadata of every dataset, used to build the menus without reading them
+CATALOG_PATH = './cache-directory/catalog.json'
+# uploads are streamed into UPLOAD_PATH, then checked UPLOAD_PARSE_ROWS rows at a time
+UPLOAD_PATH = './cache-directory/uploads/'
+UPLOAD_MAX_BYTES = 1024 * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+UPLOAD_PARSE_ROWS = 100000
+# larger files go through /upload rather than as base64 through dcc.Upload
+UPLOAD_INLINE_MAX_BYTES = 20 * 1024 * 1024
+# downloads are streamed DOWNLOAD_CHUNK_BYTES at a time; the preview table
+# fetches PREVIEW_PAGE_SIZE rows per page
+DOWNLOAD_CHUNK_BYTES = 256 * 1024
+PREVIEW_PAGE_SIZE = 25
+# run the dashboard's loading, validation and statistics in a process pool,
+# with results kept in JOB_PATH for JOB_EXPIRY_S and the page polling for them
+BACKGROUND_JOBS = True
+JOB_WORKERS = 2
+JOB_PATH = './cache-directory/jobs/'
+JOB_EXPIRY_S = 60 * 60
+JOB_POLL_MS = 1000
+# yearly datasets combined into the multi-year panel
+PANEL_FILE_PATTERN = r'^worldBank\d{4}\.csv$'
+
+# configure cache, shared by all workers (used for serialized figures)
+cache = Cache(app.server, config={
+    'CACHE_TYPE': 'filesystem',
+    'CACHE_DIR': CACHE_PATH + 'figures',
+    'CACHE_THRESHOLD': 100,
+    'CACHE_DEFAULT_TIMEOUT': CACHE_TIMEOUT_S
+})
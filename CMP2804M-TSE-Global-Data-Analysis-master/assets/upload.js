@@ -0,0 +1,77 @@
+/* Streams the file picked with the #stream-upload button to the server's /upload route,
+ * rather than base64 encoding it into a Dash callback like dcc.Upload does.
+ * Dash serves everything in assets/ automatically.
+ */
+(function () {
+    function uploadId() {
+        var bytes = new Uint8Array(16);
+        window.crypto.getRandomValues(bytes);
+        return Array.prototype.map.call(bytes, function (b) {
+            return ('0' + b.toString(16)).slice(-2);
+        }).join('');
+    }
+
+    function show(text) {
+        var progress = document.getElementById('stream-upload-progress');
+        if (progress) {
+            progress.textContent = text;
+        }
+    }
+
+    // The button is rendered by Dash after this script runs, so listen on the document
+    document.addEventListener('click', function (event) {
+        if (event.target.id !== 'stream-upload') {
+            return;
+        }
+        var input = document.createElement('input');
+        input.type = 'file';
+        input.accept = '.csv';
+        input.addEventListener('change', function () {
+            if (input.files.length) {
+                send(input.files[0]);
+            }
+        });
+        input.click();
+    });
+
+    function send(file) {
+        var id = uploadId();
+        var poll = null;
+        var xhr = new XMLHttpRequest();
+
+        xhr.open('PUT', 'upload/' + encodeURIComponent(file.name) + '?id=' + id);
+        xhr.upload.onprogress = function (e) {
+            if (e.lengthComputable) {
+                show('Uploading: ' + Math.round(100 * e.loaded / e.total) + '%');
+            }
+        };
+        // once sent, the server is checking the file: poll its progress
+        xhr.upload.onload = function () {
+            poll = window.setInterval(function () {
+                fetch('upload/progress/' + id).then(function (r) {
+                    return r.json();
+                }).then(function (p) {
+                    if (p.state === 'parsing') {
+                        show('Checking: ' + p.rows.toLocaleString() + ' rows');
+                    }
+                });
+            }, 1000);
+        };
+        xhr.onloadend = function () {
+            window.clearInterval(poll);
+            var result = {};
+            try {
+                result = JSON.parse(xhr.responseText);
+            } catch (e) {
+                result.error = xhr.statusText || 'Upload failed';
+            }
+            if (xhr.status === 201) {
+                // the dataset list is built when the layout is served
+                window.location.reload();
+            } else {
+                show('Error: ' + result.error);
+            }
+        };
+        xhr.send(file);
+    }
+})();
@@ -0,0 +1,219 @@
+"""Times the data pipeline on synthetic worldBank datasets of growing size.
+
+    python benchmarks/bench_pipeline.py                      # 10^3 .. 10^6 rows
+    python benchmarks/bench_pipeline.py --sizes 1e3,1e7
+    python benchmarks/bench_pipeline.py --save-baseline      # after a known-good run
+
+Every run is written to benchmarks/results/latest.json and compared with
+benchmarks/results/baseline.json if there is one; the exit status is 1 if any
+stage got slower than --tolerance times its baseline, so it can gate a deploy.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import warnings
+from datetime import datetime
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_PATH)
+
+import numpy as np
+import pandas as pd
+import graphs
+import regression
+from stats import normalize, power_transform, summary_statistics, yeo_johnson_lambdas
+from validator import Validator
+
+TEMPLATE_PATH = os.path.join(BASE_PATH, 'datasets', 'worldBank2011.csv')
+COUNTRIES_PATH = os.path.join(BASE_PATH, 'assets', 'countries.json')
+RESULTS_PATH = os.path.join(BASE_PATH, 'benchmarks', 'results')
+
+X_VARIABLE = 'GDP per capita (current US$)'
+Y_VARIABLE = 'Life expectancy at birth, total (years)'
+# builders that draw one mark per row are skipped above --max-plot-rows
+PER_POINT_BUILDERS = ('choropleth', 'scatter_plot', 'scatter_plot_ols', 'box_plot')
+# share of rows with a location the validator should drop
+INVALID_SHARE = 0.02
+
+
+def location_variants(countries):
+    """How the same country turns up in real datasets: names in any case,
+    official names, ISO codes and the odd typo."""
+    variants = []
+    for country in countries:
+        name = country['country']
+        variants += [name, name.title(), name.upper(), country['state'].title(), country['a2'], country['a3']]
+    invalid = ['Unknown', 'N/A', 'World', 'Euro area', 'Sub-Saharan Africa (excluding high income)', 'Atlantis']
+    return np.array(variants, dtype=object), np.array(invalid, dtype=object)
+
+
+def synthetic_dataset(rows, template, countries, seed=0):
+    """A frame with the template's columns. Numeric columns are resampled
+    from the template's values with a little noise, so skew and missing
+    values are realistic."""
+    rng = np.random.RandomState(seed)
+    valid, invalid = location_variants(countries)
+    data = {}
+    for column in template.columns:
+        values = template[column].to_numpy()
+        if column == 'Country Code':
+            locations = valid[rng.randint(len(valid), size=rows)]
+            bad = rng.rand(rows) < INVALID_SHARE
+            locations[bad] = invalid[rng.randint(len(invalid), size=bad.sum())]
+            data[column] = locations
+        elif template[column].dtype == object:
+            data[column] = values[rng.randint(len(values), size=rows)]
+        else:
+            sample = values[rng.randint(len(values), size=rows)].astype(float)
+            data[column] = sample * rng.normal(1, 0.01, size=rows)
+    return pd.DataFrame(data, columns=template.columns)
+
+
+def timed(results, name, func, repeat):
+    """Best of `repeat` runs of func(), stored in results[name]; returns the
+    last result or None if it failed."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        try:
+            result = func()
+        except Exception as error:
+            print('  {:<28} failed: {!r}'.format(name, error))
+            results[name] = None
+            return None
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    results[name] = best
+    print('  {:<28} {:>10.4f} s'.format(name, best))
+    return result
+
+
+def bench_size(rows, template, countries, repeat, max_plot_rows):
+    print('{:,} rows'.format(rows))
+    results = {}
+    df = synthetic_dataset(rows, template, countries)
+
+    validated = timed(results, 'validate', lambda: Validator([df.copy()]).validate(), repeat)
+    if validated is None:
+        validated = df
+    timed(results, 'normalize_min_max', lambda: normalize(df.copy(), 'Min-Max'), repeat)
+    timed(results, 'normalize_z_score', lambda: normalize(df.copy(), 'Z-Score'), repeat)
+    timed(results, 'power_transform', lambda: power_transform(df.copy()), repeat)
+    # what the app does once the lambdas are in the catalog
+    lambdas = yeo_johnson_lambdas(df)
+    timed(results, 'power_transform_fitted', lambda: power_transform(df.copy(), lambdas), repeat)
+    timed(results, 'summary_statistics', lambda: summary_statistics(df), repeat)
+
+    ols = timed(results, 'regression_ols',
+                lambda: regression.fit(validated[X_VARIABLE], validated[Y_VARIABLE], 'ols'), repeat)
+    timed(results, 'regression_lowess',
+          lambda: regression.fit(validated[X_VARIABLE], validated[Y_VARIABLE], 'lowess'), repeat)
+
+    builders = {
+        'choropleth': lambda: graphs.choropleth(validated, X_VARIABLE, 'Country Code', 'blues'),
+        'histogram': lambda: graphs.histogram(df, X_VARIABLE, 'None'),
+        'overlaid_histogram': lambda: graphs.overlaid_histogram(df, X_VARIABLE, Y_VARIABLE),
+        'scatter_plot': lambda: graphs.scatter_plot(validated, X_VARIABLE, Y_VARIABLE, 'Country Code', None, 'None'),
+        'scatter_plot_ols': lambda: graphs.scatter_plot(validated, X_VARIABLE, Y_VARIABLE, 'Country Code', ols, 'None'),
+        'box_plot': lambda: graphs.box_plot(df, X_VARIABLE),
+        'contour_plot': lambda: graphs.contour_plot(df, X_VARIABLE, Y_VARIABLE),
+        'heat_map': lambda: graphs.heat_map(df, X_VARIABLE, Y_VARIABLE, 'None'),
+    }
+    for name, build in builders.items():
+        if name in PER_POINT_BUILDERS and rows > max_plot_rows:
+            continue
+        fig = timed(results, 'build_' + name, build, repeat)
+        if fig is not None:
+            payload = timed(results, 'serialize_' + name, fig.to_json, repeat)
+            results['bytes_' + name] = len(payload)
+    return results
+
+
+def compare(current, baseline, tolerance):
+    """Stages slower than `tolerance` times the baseline, or failing (None
+    seconds) where the baseline has a time, as (size, stage, baseline
+    seconds, current seconds)."""
+    slower = []
+    for size, stages in current.items():
+        # a stage missing from this run failed before it could be timed
+        for stage, before in baseline.get(size, {}).items():
+            seconds = stages.get(stage)
+            if stage.startswith('bytes_') or before is None:
+                continue
+            if seconds is None:
+                slower.append((size, stage, before, None))
+            # ignore noise on stages that take next to no time
+            elif seconds > before * tolerance and seconds - before > 0.01:
+                slower.append((size, stage, before, seconds))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='1e3,1e4,1e5,1e6',
+                        help='comma separated row counts, up to 1e7 (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage, the best is kept')
+    parser.add_argument('--max-plot-rows', type=float, default=1e6,
+                        help='largest size for builders that draw every row')
+    parser.add_argument('--output', default=os.path.join(RESULTS_PATH, 'latest.json'))
+    parser.add_argument('--baseline', default=os.path.join(RESULTS_PATH, 'baseline.json'))
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='slowdown over the baseline reported as a regression')
+    parser.add_argument('--save-baseline', action='store_true', help='also store this run as the baseline')
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings('ignore')
+    template = pd.read_csv(TEMPLATE_PATH)
+    with open(COUNTRIES_PATH, encoding='utf-8') as file:
+        countries = json.load(file)
+
+    results = {}
+    for size in args.sizes.split(','):
+        rows = int(float(size))
+        results[str(rows)] = bench_size(rows, template, countries, args.repeat, args.max_plot_rows)
+
+    run = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.platform(),
+        'results': results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(run, file, indent=2)
+    print('Results written to {}'.format(args.output))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump(run, file, indent=2)
+        print('Baseline written to {}'.format(args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('No baseline at {}, nothing to compare with.'.format(args.baseline))
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as file:
+        baseline = json.load(file)['results']
+    slower = compare(results, baseline, args.tolerance)
+    for size, stage, before, seconds in slower:
+        if seconds is None:
+            print('REGRESSION {:>10} rows {:<28} {:.4f} s -> failed'.format(size, stage, before))
+        else:
+            print('REGRESSION {:>10} rows {:<28} {:.4f} s -> {:.4f} s ({:.0%})'.format(
+                size, stage, before, seconds, seconds / before - 1))
+    if not slower:
+        print('No stage slower than {:.0%} of the baseline.'.format(args.tolerance))
+    return 1 if slower else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,396 @@
+"""Replays Dash callback traffic against the app to size the gunicorn fleet.
+
+    python benchmarks/loadtest.py                              # in this process
+    python benchmarks/loadtest.py --configs 1x1,2x4,4x2        # gunicorn workers x threads
+    python benchmarks/loadtest.py --url http://127.0.0.1:8050 --pid 1234
+
+Each simulated session walks through the steps of a session file (see
+benchmarks/session.json) the way a browser would, posting to
+/_dash-update-component and keeping the values the responses set. Throughput,
+p50/p95/p99 latency per step and the peak RSS of the server's processes are
+reported for every configuration.
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+import numpy as np
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SESSION_PATH = os.path.join(BASE_PATH, 'benchmarks', 'session.json')
+UPDATE_PATH = '/_dash-update-component'
+DEPENDENCIES_PATH = '/_dash-dependencies'
+PERCENTILES = (50, 95, 99)
+GUNICORN_MAIN = 'from gunicorn.app.wsgiapp import run; run()'
+
+
+class InProcessClient(object):
+    """Requests through the Flask test client of the app imported here."""
+
+    def __init__(self, server):
+        self.client = server.test_client()
+
+    def get(self, path):
+        response = self.client.get(path)
+        return response.status_code, response.data
+
+    def post(self, path, payload):
+        response = self.client.post(path, json=payload)
+        return response.status_code, response.data
+
+
+class HttpClient(object):
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def request(self, path, data=None):
+        request = urllib.request.Request(self.url + path, data=data,
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=300) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.read()
+
+    def get(self, path):
+        return self.request(path)
+
+    def post(self, path, payload):
+        return self.request(path, json.dumps(payload).encode('utf-8'))
+
+
+def split_outputs(output):
+    # multi output callbacks are keyed '..a.children...b.figure..'
+    if output.startswith('..'):
+        return output[2:-2].split('...')
+    return [output]
+
+
+def prop(key):
+    component, _, name = key.rpartition('.')
+    return component, name
+
+
+class Session(object):
+    """One browser tab: the values of every component property it knows."""
+
+    def __init__(self, client, callbacks, values):
+        self.client = client
+        self.callbacks = callbacks
+        self.values = dict(values)
+
+    def payload(self, output, trigger):
+        callback = self.callbacks[output]
+        outputs = [dict(zip(('id', 'property'), prop(key))) for key in split_outputs(callback['output'])]
+        return {
+            'output': callback['output'],
+            'outputs': outputs if len(outputs) > 1 else outputs[0],
+            'inputs': [dict(item, value=self.values.get(item['id'] + '.' + item['property']))
+                       for item in callback['inputs']],
+            'state': [dict(item, value=self.values.get(item['id'] + '.' + item['property']))
+                      for item in callback['state']],
+            'changedPropIds': [trigger],
+        }
+
+    def call(self, output, trigger):
+        """Post one callback; returns (status, seconds, response bytes)."""
+        # clicks and intervals count up like they do in the browser
+        if trigger.endswith('.n_clicks') or trigger.endswith('.n_intervals'):
+            self.values[trigger] = (self.values.get(trigger) or 0) + 1
+        payload = self.payload(output, trigger)
+
+        start = time.perf_counter()
+        status, body = self.client.post(UPDATE_PATH, payload)
+        elapsed = time.perf_counter() - start
+
+        if status == 200:
+            response = json.loads(body.decode('utf-8'))['response']
+            if 'props' in response:
+                # single output responses from older versions of Dash
+                component, name = prop(split_outputs(payload['output'])[0])
+                response = {component: response['props']}
+            for component, props in response.items():
+                for name, value in props.items():
+                    self.values[component + '.' + name] = value
+        return status, elapsed, len(body)
+
+    def run_step(self, step, record):
+        for key, value in step.get('set', {}).items():
+            self.values[key] = value
+
+        condition = step.get('while')
+        if condition is None:
+            status, elapsed, size = self.call(step['output'], step['trigger'])
+            record(step['name'], status, elapsed, size)
+            return
+
+        # polled until the condition stops holding; the step's latency is how
+        # long the user waits, every poll counts as a request
+        start = time.perf_counter()
+        polls = 0
+        while all(self.values.get(key) == value for key, value in condition.items()):
+            time.sleep(step.get('interval', 1))
+            status, elapsed, size = self.call(step['output'], step['trigger'])
+            record(None, status, elapsed, size)
+            polls += 1
+            if status not in (200, 204) or polls >= step.get('max_polls', 600):
+                break
+        if polls:
+            record(step['name'], status, time.perf_counter() - start, 0, request=False)
+
+
+class Recorder(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+
+    def __call__(self, step, status, seconds, size, request=True):
+        with self.lock:
+            if request:
+                self.requests += 1
+                self.bytes += size
+                # 204 is a callback raising PreventUpdate, not a failure
+                if status not in (200, 204):
+                    self.errors += 1
+            if step is not None:
+                self.latencies.setdefault(step, []).append(seconds)
+
+
+def process_tree(pid):
+    """pid and the pids of all its descendants, from /proc."""
+    parents = {}
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                with open('/proc/{}/stat'.format(name)) as file:
+                    # the command name can hold spaces, fields after it can't
+                    fields = file.read().rpartition(')')[2].split()
+                parents.setdefault(int(fields[1]), []).append(int(name))
+            except (OSError, IndexError):
+                pass
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(parents.get(current, []))
+    return tree
+
+
+def rss_bytes(pid):
+    try:
+        with open('/proc/{}/status'.format(pid)) as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class RssSampler(threading.Thread):
+    """Peak total and peak single-process RSS of a process tree."""
+
+    def __init__(self, pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_total = 0
+        self.peak_process = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        if not os.path.isdir('/proc'):
+            return
+        while not self.stopped.is_set():
+            sizes = [rss_bytes(pid) for pid in process_tree(self.pid)]
+            self.peak_total = max(self.peak_total, sum(sizes))
+            self.peak_process = max([self.peak_process] + sizes)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def load_callbacks(client):
+    status, body = client.get(DEPENDENCIES_PATH)
+    if status != 200:
+        raise RuntimeError('{} returned {}'.format(DEPENDENCIES_PATH, status))
+    callbacks = {}
+    for callback in json.loads(body.decode('utf-8')):
+        for output in split_outputs(callback['output']):
+            callbacks[output] = callback
+    return callbacks
+
+
+def run_load(make_client, scenario, sessions, iterations, pid):
+    """Run `sessions` concurrent sessions of the scenario and summarise them."""
+    callbacks = load_callbacks(make_client())
+    recorder = Recorder()
+    failures = []
+
+    def session_worker():
+        try:
+            for _ in range(iterations):
+                session = Session(make_client(), callbacks, scenario['values'])
+                for step in scenario['steps']:
+                    session.run_step(step, recorder)
+        except Exception as error:
+            failures.append(repr(error))
+
+    sampler = RssSampler(pid) if pid is not None else None
+    if sampler is not None:
+        sampler.start()
+    threads = [threading.Thread(target=session_worker) for _ in range(sessions)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if sampler is not None:
+        sampler.stop()
+
+    steps = {}
+    for step in scenario['steps']:
+        latencies = recorder.latencies.get(step['name'])
+        if latencies:
+            values = np.percentile(latencies, PERCENTILES)
+            steps[step['name']] = dict({'count': len(latencies)},
+                                       **{'p{}'.format(p): value for p, value in zip(PERCENTILES, values)})
+    every = [seconds for step in scenario['steps'] if 'while' not in step
+             for seconds in recorder.latencies.get(step['name'], [])]
+    overall = dict(zip(['p{}'.format(p) for p in PERCENTILES],
+                       np.percentile(every, PERCENTILES) if every else [None] * len(PERCENTILES)))
+    return {
+        'sessions': sessions,
+        'iterations': iterations,
+        'seconds': elapsed,
+        'requests': recorder.requests,
+        'errors': recorder.errors,
+        'session_failures': failures,
+        'requests_per_second': recorder.requests / elapsed,
+        'sessions_per_second': sessions * iterations / elapsed,
+        'response_bytes': recorder.bytes,
+        'latency': overall,
+        'steps': steps,
+        'peak_rss_bytes': sampler.peak_total if sampler is not None else None,
+        'peak_process_rss_bytes': sampler.peak_process if sampler is not None else None,
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url, server, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('gunicorn exited with status {}'.format(server.returncode))
+        try:
+            urllib.request.urlopen(url + DEPENDENCIES_PATH, timeout=5).close()
+            return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    raise RuntimeError('gunicorn did not start within {} s'.format(timeout))
+
+
+def run_gunicorn(config, scenario, sessions, iterations):
+    """Start `gunicorn index:application` as `workers`x`threads` and load it."""
+    workers, threads = (int(part) for part in config.split('x'))
+    port = free_port()
+    url = 'http://127.0.0.1:{}'.format(port)
+    # gunicorn 20.0 can't be run with -m, its entry point works in any version
+    command = [sys.executable, '-c', GUNICORN_MAIN, 'index:application', '--bind', '127.0.0.1:{}'.format(port),
+               '--workers', str(workers), '--threads', str(threads), '--timeout', '300', '--log-level', 'warning']
+    server = subprocess.Popen(command, cwd=BASE_PATH)
+    try:
+        wait_until_up(url, server)
+        return run_load(lambda: HttpClient(url), scenario, sessions, iterations, server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def megabytes(value):
+    return '{:.0f} MB'.format(value / 2 ** 20) if value else 'n/a'
+
+
+def milliseconds(value):
+    return '{:.0f}'.format(value * 1000) if value is not None else '-'
+
+
+def report(name, result):
+    print('\n{}: {} sessions x {} iterations in {:.1f} s'.format(
+        name, result['sessions'], result['iterations'], result['seconds']))
+    print('  {} requests, {} errors, {:.1f} requests/s, {:.2f} sessions/s'.format(
+        result['requests'], result['errors'], result['requests_per_second'], result['sessions_per_second']))
+    print('  peak RSS {} in all, {} in one process'.format(
+        megabytes(result['peak_rss_bytes']), megabytes(result['peak_process_rss_bytes'])))
+    for failure in result['session_failures']:
+        print('  session failed: {}'.format(failure))
+    print('  {:<34} {:>6} {:>8} {:>8} {:>8}'.format('step (ms)', 'count', 'p50', 'p95', 'p99'))
+    for step, stats in list(result['steps'].items()) + [('all steps', dict(result['latency'], count=''))]:
+        print('  {:<34} {:>6} {:>8} {:>8} {:>8}'.format(
+            step, stats['count'], milliseconds(stats['p50']), milliseconds(stats['p95']), milliseconds(stats['p99'])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--session', default=SESSION_PATH, help='session file to replay (default: %(default)s)')
+    parser.add_argument('--sessions', type=int, default=8, help='concurrent sessions')
+    parser.add_argument('--iterations', type=int, default=3, help='times each session replays the session file')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--configs', help='comma separated gunicorn WORKERSxTHREADS configurations to start')
+    target.add_argument('--url', help='load a server that is already running')
+    parser.add_argument('--pid', type=int, help='with --url, the server process to measure RSS of')
+    parser.add_argument('--output', help='also write the results as JSON')
+    args = parser.parse_args(argv)
+
+    with open(args.session, encoding='utf-8') as file:
+        scenario = json.load(file)
+
+    results = {}
+    if args.configs:
+        for config in args.configs.split(','):
+            results['gunicorn ' + config] = run_gunicorn(config, scenario, args.sessions, args.iterations)
+            report('gunicorn ' + config, results['gunicorn ' + config])
+    elif args.url:
+        results[args.url] = run_load(lambda: HttpClient(args.url), scenario, args.sessions, args.iterations, args.pid)
+        report(args.url, results[args.url])
+    else:
+        # the app reads its datasets and caches relative to its own directory
+        os.chdir(BASE_PATH)
+        sys.path.insert(0, BASE_PATH)
+        import index
+        server = index.application
+        results['in-process'] = run_load(lambda: InProcessClient(server), scenario,
+                                         args.sessions, args.iterations, os.getpid())
+        report('in-process', results['in-process'])
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'created': datetime.now().isoformat(timespec='seconds'),
+                       'machine': platform.platform(),
+                       'session': os.path.abspath(args.session),
+                       'results': results}, file, indent=2)
+    return 1 if any(result['errors'] or result['session_failures'] for result in results.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Thread-safe least-recently-used cache.
+
+    Entries are evicted oldest-first once either `max_entries` is exceeded or,
+    when a `sizeof` function is given, the summed size passes `max_bytes`.
+    """
+
+    def __init__(self, max_entries=32, max_bytes=None, sizeof=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, _ = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        size = self.sizeof(value) if self.sizeof is not None else 0
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            # never cache something that could not fit on its own
+            if self.max_bytes is not None and size > self.max_bytes:
+                return value
+            self._entries[key] = (value, size)
+            self.nbytes += size
+            while len(self._entries) > self.max_entries or \
+                    (self.max_bytes is not None and self.nbytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return value
+
+    def discard(self, predicate):
+        """Drop every entry whose key satisfies `predicate`."""
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.nbytes,
+            }
+
+    def _remove(self, key):
+        _, size = self._entries.pop(key)
+        self.nbytes -= size
@@ -0,0 +1,222 @@
+import fcntl
+import hashlib
+import json
+import math
+import os
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+from app import CATALOG_PATH, DATASETS_PATH
+from columnar import read_sidecar
+from validator import COUNTRY_MATCHES, YEAR_MATCHES, find_column
+
+# The catalog is one JSON file mapping each dataset's filename to
+#   mtime_ns, size, sha1   of the file it describes
+#   rows, columns, dtypes
+#   country_column, year_column   as the validator would pick them, or None
+#   ranges                 {numeric column: [min, max]}
+#   lambdas                {'<normalization>|<validated>': {column: lambda}},
+#                          Yeo-Johnson lambdas added as columns are first transformed
+# It's rebuilt for changed files at startup and updated on upload, so menus
+# are listed from it rather than from the datasets themselves.
+
+_catalog = None
+_catalog_mtime_ns = None
+# filename: signature of files that couldn't be described, not retried until they change
+_unreadable = {}
+_lock = threading.Lock()
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _finite(value):
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def merge_dtypes(current, new):
+    # the dtype pandas would give the column had it seen both chunks at once
+    if current is None or current == new:
+        return new
+    if is_numeric_dtype(current) and is_numeric_dtype(new) and \
+            not is_bool_dtype(current) and not is_bool_dtype(new):
+        return np.promote_types(current, new)
+    return np.dtype(object)
+
+
+def frame_summary(chunks):
+    """The parts of a catalog entry that come from the data itself, for a
+    dataset read as `chunks` (frames with the same columns) one at a time."""
+    columns = []
+    rows = 0
+    dtypes = {}
+    ranges = {}
+    for chunk in chunks:
+        if not columns:
+            columns = [str(column) for column in chunk.columns]
+        rows += len(chunk)
+        for column, dtype in chunk.dtypes.items():
+            dtypes[str(column)] = merge_dtypes(dtypes.get(str(column)), dtype)
+        numeric = chunk.select_dtypes(include=[np.number])
+        for column, low, high in zip(numeric.columns, numeric.min(), numeric.max()):
+            current = ranges.get(str(column), (np.nan, np.nan))
+            ranges[str(column)] = (np.fmin(current[0], low), np.fmax(current[1], high))
+
+    return {
+        'rows': rows,
+        'columns': columns,
+        'dtypes': {column: str(dtype) for column, dtype in dtypes.items()},
+        'country_column': find_column(columns, COUNTRY_MATCHES),
+        'year_column': find_column(columns, YEAR_MATCHES),
+        # a column numeric in one chunk may not be in all of them
+        'ranges': {column: [_finite(low), _finite(high)] for column, (low, high) in ranges.items()
+                   if is_numeric_dtype(dtypes[column]) and not is_bool_dtype(dtypes[column])},
+    }
+
+
+def describe(filename, df=None, summary=None):
+    """Catalog entry of a dataset, from `df` if it's already been parsed or
+    its frame_summary if that's been worked out."""
+    path = os.path.join(DATASETS_PATH, filename)
+    mtime_ns, size = _signature(path)
+    if summary is None:
+        if df is None:
+            df = read_sidecar(path)
+        if df is None:
+            df = pd.read_csv(path)
+        summary = frame_summary([df])
+
+    return dict({
+        'mtime_ns': mtime_ns,
+        'size': size,
+        'sha1': file_sha1(path),
+    }, **summary)
+
+
+def _read():
+    global _catalog, _catalog_mtime_ns
+    # another worker may have rewritten it since it was last loaded
+    try:
+        mtime_ns = os.stat(CATALOG_PATH).st_mtime_ns
+    except OSError:
+        return {}
+    if _catalog is None or mtime_ns != _catalog_mtime_ns:
+        try:
+            with open(CATALOG_PATH, encoding='utf-8') as file:
+                _catalog = json.load(file)
+        except (OSError, ValueError):
+            _catalog = {}
+        _catalog_mtime_ns = mtime_ns
+    return _catalog
+
+
+def _update(change):
+    """Apply `change` to the catalog under a lock shared by every worker."""
+    global _catalog, _catalog_mtime_ns
+    directory = os.path.dirname(CATALOG_PATH)
+    os.makedirs(directory, exist_ok=True)
+    with _lock, open(CATALOG_PATH + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        catalog = dict(_read())
+        change(catalog)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump(catalog, file)
+        os.replace(tmp, CATALOG_PATH)
+        _catalog, _catalog_mtime_ns = catalog, os.stat(CATALOG_PATH).st_mtime_ns
+    return catalog
+
+
+def register(filename, df=None, summary=None):
+    entry = describe(filename, df, summary)
+    _update(lambda catalog: catalog.__setitem__(filename, entry))
+    return entry
+
+
+def refresh():
+    """Describe every new or changed CSV in the datasets directory and drop
+    entries for files that are gone."""
+    filenames = sorted(name for name in os.listdir(DATASETS_PATH) if name.endswith('.csv'))
+    current = _read()
+    entries = {}
+    for filename in filenames:
+        entry = current.get(filename)
+        try:
+            signature = _signature(os.path.join(DATASETS_PATH, filename))
+        except OSError:
+            continue
+        if (entry is None or (entry['mtime_ns'], entry['size']) != signature) \
+                and _unreadable.get(filename) != signature:
+            try:
+                entries[filename] = describe(filename)
+            except (OSError, ValueError):
+                _unreadable[filename] = signature
+
+    def change(catalog):
+        for filename in [name for name in catalog if name not in filenames]:
+            del catalog[filename]
+        catalog.update(entries)
+
+    if entries or set(current) - set(filenames):
+        _update(change)
+
+
+def datasets():
+    """Every dataset in the catalog, after adding CSVs copied into the
+    datasets directory (and dropping removed ones) since it was last looked at."""
+    filenames = set(name for name in os.listdir(DATASETS_PATH) if name.endswith('.csv'))
+    for filename in list(_unreadable):
+        try:
+            if _signature(os.path.join(DATASETS_PATH, filename)) != _unreadable[filename]:
+                del _unreadable[filename]
+        except OSError:
+            del _unreadable[filename]
+    if filenames - set(_unreadable) != set(_read()):
+        refresh()
+    return sorted(_read())
+
+
+def entry(filename):
+    """Catalog entry of `filename`, described again if the file has changed."""
+    current = _read().get(filename)
+    try:
+        signature = _signature(os.path.join(DATASETS_PATH, filename))
+    except OSError:
+        return None
+    if current is None or (current['mtime_ns'], current['size']) != signature:
+        current = register(filename)
+    return current
+
+
+def lambdas(filename, key):
+    """Yeo-Johnson lambdas stored for the dataset as prepared under `key`."""
+    current = entry(filename)
+    return dict(current.get('lambdas', {}).get(key, {})) if current is not None else {}
+
+
+def store_lambdas(filename, key, fitted):
+    """Add fitted lambdas to the entry, unless the file changed meanwhile."""
+    signature = _signature(os.path.join(DATASETS_PATH, filename))
+
+    def change(catalog):
+        current = catalog.get(filename)
+        if current is None or (current['mtime_ns'], current['size']) != signature:
+            return
+        stored = dict(current.get('lambdas', {}))
+        stored[key] = dict(stored.get(key, {}), **fitted)
+        catalog[filename] = dict(current, lambdas=stored)
+
+    _update(change)
@@ -0,0 +1,136 @@
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+from app import DATASETS_PATH, SIDECAR_PATH
+
+# bump whenever the on-disk layout changes so old sidecars are rebuilt
+FORMAT_VERSION = 1
+
+
+# Each dataset gets a directory of per-column .npy files plus a meta.json
+# recording the source file it was built from. Reading one is a straight load
+# of each column instead of parsing the CSV text again. The frame handed back
+# is always a private, writable copy: pandas consolidates same-typed columns
+# into one block anyway, and callers modify frames in place.
+def sidecar_dir(path):
+    return os.path.join(SIDECAR_PATH, os.path.basename(path))
+
+
+def _source_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _save_column(directory, idx, series):
+    column_path = os.path.join(directory, '{}.npy'.format(idx))
+    if is_numeric_dtype(series) or is_bool_dtype(series):
+        np.save(column_path, series.to_numpy())
+        return 'numeric'
+
+    values = series.to_numpy()
+    mask = pd.isna(values)
+    if all(isinstance(v, str) for v in values[~mask]):
+        # fixed-width unicode can be memory-mapped, missing values kept in a mask
+        strings = np.where(mask, '', values).astype(str)
+        np.save(column_path, strings)
+        np.save(os.path.join(directory, '{}.mask.npy'.format(idx)), mask)
+        return 'string'
+
+    np.save(column_path, values, allow_pickle=True)
+    return 'object'
+
+
+def write_sidecar(path, df=None):
+    """Write the columnar copy of the CSV at `path`, parsing it if `df` is None."""
+    mtime_ns, size = _source_signature(path)
+    if df is None:
+        df = pd.read_csv(path)
+
+    os.makedirs(SIDECAR_PATH, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=SIDECAR_PATH, prefix='.tmp-')
+    try:
+        columns = []
+        for idx, column in enumerate(df.columns):
+            kind = _save_column(tmp, idx, df[column])
+            columns.append({'name': column, 'kind': kind, 'dtype': str(df[column].dtype)})
+
+        meta = {
+            'version': FORMAT_VERSION,
+            'source_mtime_ns': mtime_ns,
+            'source_size': size,
+            'rows': len(df),
+            'columns': columns,
+        }
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as file:
+            json.dump(meta, file)
+
+        target = sidecar_dir(path)
+        if os.path.isdir(target):
+            shutil.rmtree(target, ignore_errors=True)
+        try:
+            os.rename(tmp, target)
+        except OSError:
+            # another worker published the same sidecar first
+            shutil.rmtree(tmp, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def read_meta(path):
+    """Return the sidecar metadata for `path`, or None if missing or stale."""
+    try:
+        with open(os.path.join(sidecar_dir(path), 'meta.json'), encoding='utf-8') as file:
+            meta = json.load(file)
+        mtime_ns, size = _source_signature(path)
+    except (OSError, ValueError):
+        return None
+
+    if meta.get('version') != FORMAT_VERSION or \
+            meta['source_mtime_ns'] != mtime_ns or meta['source_size'] != size:
+        return None
+    return meta
+
+
+def _load_column(directory, idx, kind):
+    column_path = os.path.join(directory, '{}.npy'.format(idx))
+    if kind == 'numeric':
+        return np.load(column_path, mmap_mode='r')
+    if kind == 'string':
+        values = np.load(column_path, mmap_mode='r').astype(object)
+        values[np.load(os.path.join(directory, '{}.mask.npy'.format(idx)))] = np.nan
+        return values
+    return np.load(column_path, allow_pickle=True)
+
+
+def read_sidecar(path, columns=None):
+    """Load the dataset at `path` from its sidecar, or None if it is stale.
+    Only `columns` are read if given, in the order they are in the file."""
+    meta = read_meta(path)
+    if meta is None:
+        return None
+
+    directory = sidecar_dir(path)
+    wanted = [(idx, column) for idx, column in enumerate(meta['columns'])
+              if columns is None or column['name'] in columns]
+    try:
+        data = {column['name']: _load_column(directory, idx, column['kind']) for idx, column in wanted}
+    except (OSError, ValueError):
+        return None
+    # copy out of the read-only maps so the frame is writable
+    return pd.DataFrame(data, columns=[column['name'] for _, column in wanted], copy=True)
+
+
+def build_sidecars():
+    """Make sure every CSV in the datasets directory has a fresh sidecar."""
+    for filename in sorted(os.listdir(DATASETS_PATH)):
+        path = os.path.join(DATASETS_PATH, filename)
+        if filename.endswith('.csv') and read_meta(path) is None:
+            try:
+                write_sidecar(path)
+            except (OSError, ValueError):
+                pass
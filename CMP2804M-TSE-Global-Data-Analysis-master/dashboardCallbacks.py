@@ -0,0 +1,131 @@
+import traceback
+import uuid
+import dash
+import dash_html_components as html
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
+from app import app, BACKGROUND_JOBS
+from helpers import Dashboard, dataset_key
+from graphCallbacks import choropleth_panel, graph_menu_panel
+from uiCallbacks import summary_stats_panel, covariance_correlation_panel
+import jobs
+
+
+def isolated(panel, *args):
+    """panel(*args), or its error shown in place of the panel so one failing
+    panel doesn't lose the others."""
+    try:
+        return panel(*args)
+    except jobs.JobCancelled:
+        raise
+    except Exception as error:
+        traceback.print_exc()
+        return html.H4("Error: {}".format(str(error) or repr(error)))
+
+
+def build_panels(filename,
+                 x_variable,
+                 y_variable,
+                 countries,
+                 colour_scheme,
+                 normalization,
+                 transformation,
+                 choropleth_mode,
+                 progress=None):
+    """Every panel of the dashboard, with None for the correlation panel when
+    only one variable is selected. `progress` is called between stages when
+    run as a background job."""
+    if progress is None:
+        progress = lambda fraction, message: None
+
+    progress(0.05, "Loading and transforming dataset")
+    dashboard = Dashboard(filename, normalization, transformation)
+    progress(0.3, "Validating locations and building map")
+    choropleth = isolated(choropleth_panel, dashboard, x_variable, countries, colour_scheme, choropleth_mode)
+    progress(0.55, "Building graphs")
+    graphs = isolated(graph_menu_panel, dashboard, x_variable, y_variable)
+    progress(0.7, "Computing summary statistics")
+    stats = isolated(summary_stats_panel, dashboard, x_variable, y_variable, transformation)
+
+    covar_corr = None
+    if y_variable is not None:
+        progress(0.8, "Computing correlations and regression")
+        covar_corr = isolated(covariance_correlation_panel, dashboard, x_variable, y_variable, countries, colour_scheme)
+
+    return [choropleth, graphs, stats, covar_corr]
+
+
+def panel_outputs(panels):
+    # correlation panel is left as is when only one variable is selected
+    return panels[:3] + [dash.no_update if panels[3] is None else panels[3]]
+
+
+# One callback for every panel of the dashboard, so a click loads, validates
+# and transforms the dataset once rather than once per panel. With
+# BACKGROUND_JOBS the work is submitted to jobs.py and the job-poll interval
+# picks up the panels once they're ready.
+@app.callback([Output('choropleth-output-area', 'children'),
+    Output('graph-creation-area', 'children'),
+    Output('stats', 'children'),
+    Output('covar-corr', 'children'),
+    Output('job', 'data'),
+    Output('job-poll', 'disabled'),
+    Output('job-status', 'children')],
+    [Input('create-dashboard', 'n_clicks'), Input('job-poll', 'n_intervals'),
+    Input('cancel-job', 'n_clicks')],
+    [State('files', 'value'), State('x-variable-dropdown', 'value'),
+    State('y-variable-dropdown', 'value'), State('countries', 'value'),
+    State('colour-dropdown', 'value'), State('normalization-radio', 'value'),
+    State('transformation-radio', 'value'), State('choropleth-mode-radio', 'value'),
+    State('job', 'data')])
+def create_dashboard(n_clicks,
+                    n_intervals,
+                    cancel_clicks,
+                    filename,
+                    x_variable,
+                    y_variable,
+                    countries,
+                    colour_scheme,
+                    normalization,
+                    transformation,
+                    choropleth_mode,
+                    job):
+    triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+    unchanged = [dash.no_update] * 4
+
+    if 'cancel-job.n_clicks' in triggered and cancel_clicks is not None:
+        if job is None:
+            raise PreventUpdate
+        # the job carries on if another session is waiting for the same panels
+        jobs.cancel(job['id'], job['watcher'])
+        return unchanged + [None, True, "Cancelled."]
+
+    if 'create-dashboard.n_clicks' in triggered and n_clicks is not None:
+        args = (filename, x_variable, y_variable, countries, colour_scheme,
+                normalization, transformation, choropleth_mode)
+        if not BACKGROUND_JOBS:
+            return panel_outputs(build_panels(*args)) + [None, True, None]
+        # the dataset's mtime is passed along so an edited file is a new job;
+        # identical jobs are shared, each session waiting on one is a watcher
+        job = {'id': jobs.submit(run_dashboard_job, dataset_key(filename), *args),
+               'watcher': uuid.uuid4().hex}
+
+    if job is None:
+        raise PreventUpdate
+
+    jobs.watch(job['id'], job['watcher'])
+    status = jobs.status(job['id'])
+    if status is None:
+        return unchanged + [None, True, None]
+    if status['state'] == 'cancelled':
+        return unchanged + [None, True, "Cancelled."]
+    if status['state'] == 'failed':
+        return unchanged + [None, True, html.H4("Error: {}".format(status['message']))]
+    if status['state'] == 'done':
+        return panel_outputs(jobs.result(job['id'])) + [None, True, None]
+    return unchanged + [job, False, "{} ({:.0%})".format(status['message'], status['progress'])]
+
+
+def run_dashboard_job(key, *args, progress=None):
+    # `key` only identifies the job, see create_dashboard
+    return build_panels(*args, progress=progress)
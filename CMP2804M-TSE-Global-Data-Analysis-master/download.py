@@ -0,0 +1,133 @@
+import os
+import re
+import zlib
+import numpy as np
+from flask import Response, abort, request, send_file
+from pandas.api.types import is_numeric_dtype
+from werkzeug.utils import secure_filename
+from app import app, DATASETS_PATH, DOWNLOAD_CHUNK_BYTES
+from cache import LRUCache
+from helpers import cached_dataset, dataset_key
+
+# Row order of the preview table for each (dataset key, filter, sort)
+PREVIEW_CACHE = LRUCache(max_entries=64)
+
+FILTER_OPERATORS = [('ge', '>='), ('le', '<='), ('lt', '<'), ('gt', '>'),
+                    ('ne', '!='), ('eq', '='), ('contains',), ('datestartswith',)]
+# operator as written -> its first spelling above
+FILTER_OPERATOR_NAMES = {operator: operator_type[0]
+                         for operator_type in FILTER_OPERATORS for operator in operator_type}
+# '{column} operator value', the column first so operators inside its name are left alone
+FILTER_PART_RE = re.compile(r'^\s*(?:\{(.+?)\}|(\S+))\s*(\S+)\s+(.*?)\s*$')
+
+
+def gzip_chunks(path):
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(DOWNLOAD_CHUNK_BYTES), b''):
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+    yield compressor.flush()
+
+
+@app.server.route('/download/<filename>')
+def download(filename):
+    """Stream a dataset from disk. Clients that accept gzip get it compressed
+    on the fly; Range and conditional requests are served uncompressed."""
+    filename = secure_filename(filename)
+    path = os.path.abspath(os.path.join(DATASETS_PATH, filename))
+    if not filename.endswith('.csv') or not os.path.isfile(path):
+        abort(404)
+
+    disposition = 'attachment; filename="{}"'.format(filename)
+    accepts_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+
+    if accepts_gzip and 'Range' not in request.headers and request.args.get('gzip') != '0':
+        response = Response(gzip_chunks(path), mimetype='text/csv')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = send_file(path, mimetype='text/csv', conditional=True)
+    response.headers['Content-Disposition'] = disposition
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def split_filter_part(filter_part):
+    """(column, operator, value) of one 'and'-separated part of a DataTable
+    filter_query, such as '{GDP} > 100'."""
+    match = FILTER_PART_RE.match(filter_part)
+    if match is None or match.group(3) not in FILTER_OPERATOR_NAMES:
+        return None, None, None
+    name = match.group(1) if match.group(1) is not None else match.group(2)
+    value_part = match.group(4)
+    if value_part and value_part[0] == value_part[-1] and value_part[0] in ('"', "'", '`'):
+        value = value_part[1:-1].replace('\\' + value_part[0], value_part[0])
+    else:
+        try:
+            value = float(value_part)
+        except ValueError:
+            value = value_part
+    return name, FILTER_OPERATOR_NAMES[match.group(3)], value
+
+
+def filter_mask(df, filter_query):
+    mask = np.ones(len(df), dtype=bool)
+    for filter_part in filter_query.split(' && '):
+        column, operator, value = split_filter_part(filter_part)
+        if column not in df.columns:
+            continue
+        series = df[column]
+        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge') and is_numeric_dtype(series) \
+                and not isinstance(value, (int, float)):
+            continue
+        if operator == 'eq':
+            part = series == value
+        elif operator == 'ne':
+            part = series != value
+        elif operator == 'lt':
+            part = series < value
+        elif operator == 'le':
+            part = series <= value
+        elif operator == 'gt':
+            part = series > value
+        elif operator == 'ge':
+            part = series >= value
+        else:
+            # contains and datestartswith compare as text
+            text = series.astype(str)
+            part = text.str.contains(str(value), regex=False) if operator == 'contains' \
+                else text.str.startswith(str(value))
+        mask &= part.to_numpy(dtype=bool)
+    return mask
+
+
+def preview_order(filename, filter_query, sort_by):
+    """Positions of the dataset's rows after filtering and sorting, kept for
+    paging through them."""
+    df = cached_dataset(filename)
+    sort_by = tuple((column['column_id'], column['direction']) for column in sort_by or ()
+                    if column['column_id'] in df.columns)
+    key = (dataset_key(filename), filter_query or '', sort_by)
+
+    order = PREVIEW_CACHE.get(key)
+    if order is None:
+        order = np.flatnonzero(filter_mask(df, filter_query)) if filter_query else np.arange(len(df))
+        if sort_by:
+            # sorted positions within `order`, whatever the frame's index
+            subset = df[[column for column, _ in sort_by]].iloc[order].reset_index(drop=True)
+            subset = subset.sort_values([column for column, _ in sort_by],
+                                        ascending=[direction == 'asc' for _, direction in sort_by],
+                                        kind='mergesort', na_position='last')
+            order = order[subset.index.to_numpy()]
+        order = PREVIEW_CACHE.set(key, order)
+    return order
+
+
+def preview_page(filename, page_current, page_size, filter_query, sort_by):
+    """One page of the preview table as records, and the number of pages."""
+    order = preview_order(filename, filter_query, sort_by)
+    start = page_current * page_size
+    page = cached_dataset(filename).iloc[order[start:start + page_size]]
+    return page.to_dict('records'), max(1, -(-len(order) // page_size))
@@ -9,27 +9,17 @@ from dash.exceptions import PreventUpdate
 from dash.dependencies import Input, Output, State
 from pandas.api.types import is_string_dtype, is_numeric_dtype
 from app import app, DATASETS_PATH
+from helpers import cached_figure, load_fit
+from panel import panel
 from graphs import *
 from stats import *
-from validator import Validator
 
-# Callback to create the choropleth from user dataset
-@app.callback(Output('choropleth-output-area', 'children'),
-    [Input('create-dashboard', 'n_clicks')],
-    [State('x-variable-dropdown', 'value'), State('countries', 'value'),
-    State('files', 'value'), State('colour-dropdown', 'value'),
-    State('normalization-radio', 'value'), State('transformation-radio', 'value')])
-def create_choropleth(n_clicks,
-                    x_variable,
-                    countries,
-                    filename,
-                    colour_scheme,
-                    normalization,
-                    transformation):
-    if n_clicks is None:
-        raise PreventUpdate
+# Choropleth panel of the dashboard, see dashboardCallbacks.create_dashboard
+def choropleth_panel(dashboard, x_variable, countries, colour_scheme, mode='Single'):
+    df = dashboard.df
 
-    df = pd.read_csv(os.path.join(DATASETS_PATH, filename))
+    if mode == 'Animated' and x_variable is not None:
+        return animated_choropleth_panel(dashboard, x_variable, colour_scheme)
 
     if x_variable is None:
         return html.H4("Error: No X variable selected for analysis with dropdown.")
@@ -44,48 +34,37 @@ def create_choropleth(n_clicks,
     if not is_string_dtype(df[countries]):
         return html.H4("Error: Locations for plotting must be a string type.")
 
-    # normalize & transform if applicable
-    if normalization != 'None':
-        df = normalize(df, normalization)
-    if transformation != 'None':
-        df = power_transform(df)
-    # validate locations
-    validator = Validator([df])
-    df = validator.validate()
-
-
-    fig = choropleth(df, x_variable, countries, colour_scheme)
+    # plot from the frame with validated locations
+    fig = dashboard.figure(choropleth, x_variable, countries, colour_scheme, validated=True)
     return [
         dcc.Graph(id='user-choropleth', figure=fig),
     ]
 
 
-@app.callback(Output('graph-creation-area', 'children'),
-    [Input('create-dashboard', 'n_clicks')],
-    [State('files', 'value'), State('x-variable-dropdown', 'value'),
-    State('y-variable-dropdown', 'value'), State('normalization-radio', 'value'),
-    State('transformation-radio', 'value')])
-def populate_graph_menu(n_clicks,
-                        filename,
-                        x_variable,
-                        y_variable,
-                        normalization,
-                        transformation):
-    if n_clicks is None:
-        raise PreventUpdate
+def animated_choropleth_panel(dashboard, x_variable, colour_scheme):
+    # only the yearly datasets are part of the panel
+    if not panel.pattern.match(dashboard.filename):
+        return html.H4("Error: Animated choropleths are only available for the yearly worldBank datasets.")
+
+    frames = panel.choropleth_frames(x_variable)
+    if frames is None or not frames.years:
+        return html.H4("Error: Can not animate a variable that isn't in the yearly datasets.")
+
+    fig = animated_choropleth(frames, x_variable, colour_scheme)
+    return [
+        dcc.Graph(id='user-choropleth', figure=fig),
+    ]
 
-    df = pd.read_csv(os.path.join(DATASETS_PATH, filename))
-    if normalization != 'None':
-        df = normalize(df, normalization)
-    if transformation != 'None':
-        df = power_transform(df)
 
+# Graph menu panel of the dashboard, see dashboardCallbacks.create_dashboard
+def graph_menu_panel(dashboard, x_variable, y_variable):
+    df = dashboard.df
 
     # Default/starting graph - overlaid histogram if two variables selected
     if x_variable is not None and is_numeric_dtype(df[x_variable]) and y_variable is None:
-        fig = histogram(df, x_variable, 'None')
+        fig = dashboard.figure(histogram, x_variable, 'None')
     elif x_variable is not None and is_numeric_dtype(df[x_variable]) and y_variable is not None and is_numeric_dtype(df[y_variable]):
-        fig = overlaid_histogram(df, x_variable, y_variable)
+        fig = dashboard.figure(overlaid_histogram, x_variable, y_variable)
     else:
         return html.H4("Error: Can not create graph from none quantatative variable(s)")
 
@@ -189,14 +168,8 @@ def create_histogram(n_clicks,
     if n_clicks is None:
         raise PreventUpdate
 
-    df = pd.read_csv(os.path.join(DATASETS_PATH, filename))
-    if normalization != 'None':
-        df = normalize(df, normalization)
-    if transformation != 'None':
-        df = power_transform(df)
-
-    fig = histogram(df, x_variable, margplot)
-    return fig
+    return cached_figure(histogram, filename, normalization, transformation, x_variable, margplot,
+                         columns=[x_variable], compact=True)
 
 
 @app.callback(Output('user-overlaid-histogram', 'figure'),
@@ -213,14 +186,8 @@ def create_overlaid_histogram(n_clicks,
     if n_clicks is None:
         raise PreventUpdate
 
-    df = pd.read_csv(os.path.join(DATASETS_PATH, filename))
-    if normalization != 'None':
-        df = normalize(df, normalization)
-    if transformation != 'None':
-        df = power_transform(df)
-
-    fig = overlaid_histogram(df, x_variable, y_variable)
-    return fig
+    return cached_figure(overlaid_histogram, filename, normalization, transformation, x_variable, y_variable,
+                         columns=[x_variable, y_variable], compact=True)
 
 
 @app.callback(Output('user-scatter-plot', 'figure'),
@@ -243,20 +210,14 @@ def create_scatter_plot(n_clicks,
     if n_clicks is None:
         raise PreventUpdate
 
-    df = pd.read_csv(os.path.join(DATASETS_PATH, filename))
-    validator = Validator([df])
-    df = validator.validate()
-
-    if normalization != 'None':
-        df = normalize(df, normalization)
-    if transformation != 'None':
-        df = power_transform(df)
-
     if colour_choice == 'None':
-        fig = scatter_plot(df, x_variable, y_variable, countries, regression, colour_choice)
-    else:
-        fig = scatter_plot(df, x_variable, y_variable, countries, regression, colour)
-    return fig
+        colour = colour_choice
+    fit = None
+    if regression in ('ols', 'lowess'):
+        fit = load_fit(filename, x_variable, y_variable, regression, normalization, transformation, validated=True)
+    return cached_figure(scatter_plot, filename, normalization, transformation,
+                         x_variable, y_variable, countries, fit, colour, validated=True,
+                         columns=[x_variable, y_variable, countries], compact=True)
 
 
 @app.callback(Output('user-box-plot', 'figure'),
@@ -271,14 +232,8 @@ def create_box_plot(n_clicks,
     if n_clicks is None:
         raise PreventUpdate
 
-    df = pd.read_csv(os.path.join(DATASETS_PATH, filename))
-    if normalization != 'None':
-        df = normalize(df, normalization)
-    if transformation != 'None':
-        df = power_transform(df)
-
-    fig = box_plot(df, x_variable)
-    return fig
+    return cached_figure(box_plot, filename, normalization, transformation, x_variable,
+                         columns=[x_variable], compact=True)
 
 
 @app.callback(Output('user-contour-plot', 'figure'),
@@ -295,14 +250,8 @@ def create_contour_plot(n_clicks,
     if n_clicks is None:
         raise PreventUpdate
 
-    df = pd.read_csv(os.path.join(DATASETS_PATH, filename))
-    if normalization != 'None':
-        df = normalize(df, normalization)
-    if transformation != 'None':
-        df = power_transform(df)
-
-    fig = contour_plot(df, x_variable, y_variable)
-    return fig
+    return cached_figure(contour_plot, filename, normalization, transformation, x_variable, y_variable,
+                         columns=[x_variable, y_variable], compact=True)
 
 
 @app.callback(Output('user-heat-map', 'figure'),
@@ -322,14 +271,7 @@ def create_heat_map(n_clicks,
     if n_clicks is None:
         raise PreventUpdate
 
-    df = pd.read_csv(os.path.join(DATASETS_PATH, filename))
-    if normalization != 'None':
-        df = normalize(df, normalization)
-    if transformation != 'None':
-        df = power_transform(df)
-
     if colour_choice == 'None':
-        fig = heat_map(df, x_variable, y_variable, 'None')
-    else:
-        fig = heat_map(df, x_variable, y_variable, colour)
-    return fig
+        colour = 'None'
+    return cached_figure(heat_map, filename, normalization, transformation, x_variable, y_variable, colour,
+                         columns=[x_variable, y_variable], compact=True)
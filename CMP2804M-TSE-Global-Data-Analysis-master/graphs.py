@@ -1,6 +1,8 @@
+import numpy as np
 import plotly.graph_objects as go
 import plotly_express as px
 import pandas as pd
+from pandas.api.types import is_numeric_dtype
 
 # Lists of avaliable plotly continuous colourscales etc.
 CONTINUOUS_COLOUR_SCALES = px.colors.named_colorscales()
@@ -19,6 +21,43 @@ BIVARIATE_GRAPHS = [
     'Heat Map'
 ]
 
+# Above this many rows histograms, heat maps and contour plots are binned here
+# and only the counts are sent, rather than every point being binned in the browser
+BINNING_ROW_THRESHOLD = 50000
+MAX_BINS = 200
+MAX_BINS_2D = 100
+
+
+def binned(df, *variables):
+    """Whether `variables` of `df` should be aggregated server-side."""
+    return len(df) > BINNING_ROW_THRESHOLD and all(is_numeric_dtype(df[v]) for v in variables)
+
+
+def bin_edges(values, max_bins):
+    # numpy's 'auto' rule, capped so huge datasets don't give thousands of bars
+    values = values[np.isfinite(values)]
+    edges = np.histogram_bin_edges(values, bins='auto')
+    if len(edges) - 1 > max_bins:
+        edges = np.histogram_bin_edges(values, bins=max_bins)
+    return edges
+
+
+def histogram_bars(values, edges, name=None):
+    counts, _ = np.histogram(values[np.isfinite(values)], bins=edges)
+    return go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=np.diff(edges), name=name)
+
+
+def histogram_grid(df, x_variable, y_variable):
+    """2-D bin counts of the rows where both variables are present, as
+    (x bin centres, y bin centres, counts indexed [y, x])."""
+    x = df[x_variable].to_numpy(dtype=float)
+    y = df[y_variable].to_numpy(dtype=float)
+    present = np.isfinite(x) & np.isfinite(y)
+    x, y = x[present], y[present]
+    counts, x_edges, y_edges = np.histogram2d(
+        x, y, bins=[bin_edges(x, MAX_BINS_2D), bin_edges(y, MAX_BINS_2D)])
+    return (x_edges[:-1] + x_edges[1:]) / 2, (y_edges[:-1] + y_edges[1:]) / 2, counts.T
+
 
 
 def choropleth(df, x_variable, countries, colour_scheme):
@@ -48,9 +87,71 @@ def choropleth(df, x_variable, countries, colour_scheme):
     return fig
 
 
+def animated_choropleth(frames, x_variable, colour_scheme):
+    """Choropleth with a year slider; every year ships with the figure so
+    scrubbing or playing through them happens in the browser."""
+    def trace(idx):
+        return go.Choropleth(
+            locations=frames.locations[idx],
+            z=frames.z[idx],
+            locationmode='country names',
+            colorscale=colour_scheme,
+            # one colour range for all years so they can be compared
+            zmin=frames.zmin,
+            zmax=frames.zmax,
+            text=frames.locations[idx],
+        )
+
+    fig = go.Figure(
+        data=[trace(0)],
+        frames=[go.Frame(data=[trace(idx)], name=str(year)) for idx, year in enumerate(frames.years)]
+    )
+    fig.update_layout(
+        autosize=True,
+        margin=go.layout.Margin(
+            l=10, r=10, b=25, t=25,
+            pad=2
+        ),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        title=x_variable,
+        title_x=0.5,
+        font=dict(
+            family="Courier New, monospace",
+            size=12,
+            color="#ffffff"
+        ),
+        updatemenus=[dict(
+            type='buttons',
+            showactive=False,
+            x=0.05, y=0,
+            buttons=[
+                dict(label='Play', method='animate',
+                     args=[None, dict(frame=dict(duration=500, redraw=True), fromcurrent=True)]),
+                dict(label='Pause', method='animate',
+                     args=[[None], dict(frame=dict(duration=0, redraw=False), mode='immediate')]),
+            ]
+        )],
+        sliders=[dict(
+            active=0,
+            x=0.15, len=0.85,
+            currentvalue=dict(prefix='Year: '),
+            steps=[dict(label=str(year), method='animate',
+                        args=[[str(year)], dict(frame=dict(duration=0, redraw=True), mode='immediate')])
+                   for year in frames.years]
+        )]
+    )
+    return fig
+
+
 # TODO finish implementation of histogram fig
 def histogram(df, x_variable, margplot):
-    if margplot == 'Rug':
+    if binned(df, x_variable):
+        # no rug, it would be one mark per row
+        values = df[x_variable].to_numpy(dtype=float)
+        fig = go.Figure(histogram_bars(values, bin_edges(values, MAX_BINS)))
+        fig.update_layout(bargap=0, xaxis_title_text=x_variable, yaxis_title_text='count')
+    elif margplot == 'Rug':
         fig = px.histogram(df, x=x_variable, marginal='rug', hover_data=df.columns)
     else:
         fig = px.histogram(df, x=x_variable, hover_data=df.columns)
@@ -76,8 +177,16 @@ def histogram(df, x_variable, margplot):
 
 def overlaid_histogram(df, x1_variable, x2_variable):
     fig = go.Figure()
-    fig.add_trace(go.Histogram(x=df[x1_variable], name=x1_variable))
-    fig.add_trace(go.Histogram(x=df[x2_variable], name=x2_variable))
+    if binned(df, x1_variable, x2_variable):
+        # both variables share one set of bins
+        x1 = df[x1_variable].to_numpy(dtype=float)
+        x2 = df[x2_variable].to_numpy(dtype=float)
+        edges = bin_edges(np.concatenate([x1, x2]), MAX_BINS)
+        fig.add_trace(histogram_bars(x1, edges, x1_variable))
+        fig.add_trace(histogram_bars(x2, edges, x2_variable))
+    else:
+        fig.add_trace(go.Histogram(x=df[x1_variable], name=x1_variable))
+        fig.add_trace(go.Histogram(x=df[x2_variable], name=x2_variable))
 
     fig.update_layout(
         xaxis_title_text='Value', # xaxis label
@@ -99,30 +208,26 @@ def overlaid_histogram(df, x1_variable, x2_variable):
     return fig
 
 
-def scatter_plot(df, x_variable, y_variable, countries, regression, colour):
-    if colour == 'None' and regression == 'None':
+def trendline(fit):
+    if fit.method != 'ols':
+        # r_squared is the linear fit's, it says nothing about the curve
+        return go.Scatter(x=fit.x, y=fit.y, mode='lines', name='LOWESS trendline', showlegend=False,
+                          hovertemplate='LOWESS trendline<extra></extra>')
+    return go.Scatter(x=fit.x, y=fit.y, mode='lines', name='OLS trendline', showlegend=False,
+                      hovertemplate='OLS trendline<br>R²=%{customdata:.3f}<extra></extra>',
+                      customdata=np.full(len(fit.x), fit.r_squared))
+
+
+# `fit` is a regression.Fit drawn as the trendline, or None
+def scatter_plot(df, x_variable, y_variable, countries, fit, colour):
+    if colour == 'None':
         fig = px.scatter(df, x=x_variable, y=y_variable, hover_name=countries, color=x_variable)
-    elif colour == 'None' and regression == 'ols':
-        if df[x_variable].isna().sum() != 0:
-                df[x_variable] = df[x_variable].fillna(df[x_variable].mean())
-        if df[y_variable].isna().sum() != 0:
-                df[y_variable] = df[y_variable].fillna(df[y_variable].mean())
-        fig = px.scatter(df, x=x_variable, y=y_variable, trendline="ols", hover_name=countries, color=x_variable)
-    elif colour == 'None' and regression == 'lowess':
-        fig = px.scatter(df, x=x_variable, y=y_variable, trendline="lowess", hover_name=countries, color=x_variable)
-    elif not colour == 'None' and regression == 'None':
+    else:
         fig = px.scatter(df, x=x_variable, y=y_variable, hover_name=countries,
             color_continuous_scale=colour, color=x_variable)
-    elif not colour == 'None' and regression == 'ols':
-        if df[x_variable].isna().sum() != 0:
-                df[x_variable] = df[x_variable].fillna(df[x_variable].mean())
-        if df[y_variable].isna().sum() != 0:
-                df[y_variable] = df[y_variable].fillna(df[y_variable].mean())
-        fig = px.scatter(df, x=x_variable, y=y_variable, trendline="ols", hover_name=countries,
-            color=x_variable, color_continuous_scale=colour)
-    else:
-        fig = px.scatter(df, x=x_variable, y=y_variable, trendline="lowess", hover_name=countries,
-            color=x_variable, color_continuous_scale=colour)
+
+    if fit is not None:
+        fig.add_trace(trendline(fit))
 
     fig.update_layout(
         autosize=True,
@@ -165,7 +270,14 @@ def box_plot(df, x_variable):
 
 
 def contour_plot(df, x_variable, y_variable):
-    fig = px.density_contour(df, x=x_variable, y=y_variable)
+    if binned(df, x_variable, y_variable):
+        x, y, counts = histogram_grid(df, x_variable, y_variable)
+        # contour lines only, as px.density_contour draws them
+        fig = go.Figure(go.Contour(x=x, y=y, z=counts, contours_coloring='lines',
+                                   showscale=False, hovertemplate='count=%{z}<extra></extra>'))
+        fig.update_layout(xaxis_title_text=x_variable, yaxis_title_text=y_variable)
+    else:
+        fig = px.density_contour(df, x=x_variable, y=y_variable)
 
     fig.update_layout(
         autosize=True,
@@ -185,7 +297,14 @@ def contour_plot(df, x_variable, y_variable):
 
 
 def heat_map(df, x_variable, y_variable, colour):
-    if colour == 'None':
+    if binned(df, x_variable, y_variable):
+        x, y, counts = histogram_grid(df, x_variable, y_variable)
+        fig = go.Figure(go.Heatmap(x=x, y=y, z=counts, coloraxis='coloraxis'))
+        fig.update_layout(xaxis_title_text=x_variable, yaxis_title_text=y_variable,
+                          coloraxis_colorbar_title_text='count')
+        if colour != 'None':
+            fig.update_layout(coloraxis_colorscale=colour)
+    elif colour == 'None':
         fig = px.density_heatmap(df, x=x_variable, y=y_variable)
     else:
         fig = px.density_heatmap(df, x=x_variable, y=y_variable, color_continuous_scale=colour)
@@ -204,3 +323,31 @@ def heat_map(df, x_variable, y_variable, colour):
         )
     )
     return fig
+
+
+
+def correlation_heat_map(matrix, colour):
+    fig = go.Figure(data=go.Heatmap(
+        z=matrix.values,
+        x=list(matrix.columns),
+        y=list(matrix.index),
+        zmin=-1,
+        zmax=1,
+        colorscale=colour if colour is not None else 'RdBu',
+    ))
+    fig.update_layout(
+        autosize=True,
+        margin=go.layout.Margin(
+            l=10, r=10, b=25, t=25,
+            pad=2
+        ),
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+        xaxis=dict(showticklabels=False),
+        font=dict(
+            family="Courier New, monospace",
+            size=12,
+            color="#ffffff"
+        )
+    )
+    return fig
@@ -1,17 +1,328 @@
 import base64
+import hashlib
 import io
+import json
+import numpy as np
 import pandas as pd
 from dash.exceptions import PreventUpdate
-from app import app
+from app import app, cache, DATASETS_PATH, DATASET_CACHE_ENTRIES, DATASET_CACHE_MAX_BYTES
+from app import DERIVED_CACHE_ENTRIES, DERIVED_CACHE_MAX_BYTES
+from cache import LRUCache
+from metrics import timed, watch, watch_compaction
+from columnar import read_sidecar, write_sidecar
+from regression import fit
+from stats import normalize, power_transform, yeo_johnson_lambdas, summary_statistics, correlation_matrices, kendall_tau
+from validator import Validator
+import catalog
 import os
 
 
+def frame_size(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+# Parsed datasets shared by every callback in this process
+DATASET_CACHE = LRUCache(max_entries=DATASET_CACHE_ENTRIES,
+                         max_bytes=DATASET_CACHE_MAX_BYTES,
+                         sizeof=frame_size)
+# Frames derived from them, keyed by (dataset key, validated, normalization, transformation)
+DERIVED_CACHE = LRUCache(max_entries=DERIVED_CACHE_ENTRIES,
+                         max_bytes=DERIVED_CACHE_MAX_BYTES,
+                         sizeof=frame_size)
+# Summary statistics of the derived frames, under the same keys
+SUMMARY_CACHE = LRUCache(max_entries=DERIVED_CACHE_ENTRIES * 4)
+# ... and their correlation matrices, with Kendall's tau filled in per pair
+CORRELATION_CACHE = LRUCache(max_entries=DERIVED_CACHE_ENTRIES * 4)
+# Regression fits, keyed by the derived frame's key plus (x, y, method, exact)
+FIT_CACHE = LRUCache(max_entries=DERIVED_CACHE_ENTRIES * 8)
+# bytes before and after compact_frame, summed over every frame compacted
+COMPACTION_STATS = {'frames': 0, 'bytes_before': 0, 'bytes_after': 0}
+# hit/miss counts of the figure cache in app.cache (kept per process)
+FIGURE_CACHE_STATS = {'hits': 0, 'misses': 0}
+
+# hit rates etc. of all of these are served by metrics.py at /metrics
+watch('dataset', DATASET_CACHE.stats)
+watch('derived', DERIVED_CACHE.stats)
+watch('summary', SUMMARY_CACHE.stats)
+watch('correlation', CORRELATION_CACHE.stats)
+watch('fit', FIT_CACHE.stats)
+watch('figure', lambda: FIGURE_CACHE_STATS)
+watch_compaction(lambda: COMPACTION_STATS)
+
+
 def parse_file_to_df(contents, filename):
-    content_type, content_string = contents.split(',')
-    decoded = base64.b64decode(content_string)
+    content_string = contents[contents.index(',') + 1:]
 
     if filename.endswith('.csv'):
-        df = pd.read_csv(io.StringIO(decoded.decode('utf-8')))
+        # pandas decodes the bytes itself, no need for a str copy as well
+        df = pd.read_csv(io.BytesIO(base64.b64decode(content_string)))
     else:
         raise ValueError
     return df
+
+
+def dataset_key(filename):
+    # (path, mtime, size) changes whenever the file on disk is rewritten
+    path = os.path.abspath(os.path.join(DATASETS_PATH, filename))
+    stat = os.stat(path)
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+
+def read_dataset(path, columns=None):
+    # prefer the columnar copy, the CSV is only parsed when stale
+    with timed('dataset_load'):
+        df = read_sidecar(path, columns)
+        if df is None and columns is not None:
+            df = pd.read_csv(path, usecols=lambda column: column in columns)
+        elif df is None:
+            df = pd.read_csv(path)
+            try:
+                write_sidecar(path, df)
+            except OSError:
+                pass
+    return df
+
+
+def compact_frame(df):
+    """Store floats as float32 where that is exact, integers in the smallest
+    type that holds them and repetitive strings (country and time codes) as
+    categoricals. Values are unchanged."""
+    before = frame_size(df)
+    for column in df.columns:
+        series = df[column]
+        if series.dtype == np.float64:
+            values = series.to_numpy()
+            narrow = values.astype(np.float32)
+            if ((narrow == values) | np.isnan(values)).all():
+                df[column] = narrow
+        elif pd.api.types.is_integer_dtype(series):
+            df[column] = pd.to_numeric(series, downcast='integer')
+        elif series.dtype == object and series.nunique() <= len(series) // 2:
+            df[column] = series.astype('category')
+
+    after = frame_size(df)
+    COMPACTION_STATS['frames'] += 1
+    COMPACTION_STATS['bytes_before'] += before
+    COMPACTION_STATS['bytes_after'] += after
+    return df
+
+
+def projection(filename, columns, validated=False):
+    """`columns` in file order, plus the location and year columns the
+    validator needs if `validated`."""
+    entry = catalog.entry(filename)
+    wanted = set(columns)
+    if validated:
+        wanted.update((entry['country_column'], entry['year_column']))
+    return tuple(column for column in entry['columns'] if column in wanted)
+
+
+def cached_dataset(filename):
+    """The cached frame itself, for callers that only read from it."""
+    key = dataset_key(filename)
+    df = DATASET_CACHE.get(key)
+    if df is None:
+        df = DATASET_CACHE.set(key, read_dataset(key[0]))
+    return df
+
+
+def load_dataset(filename, columns=None, compact=False):
+    """The dataset, or only `columns` of it, compacted if asked (see
+    compact_frame). Projections are cut from the whole frame if that's
+    cached, otherwise only their columns are read."""
+    if columns is None and not compact:
+        # callers normalize/validate in place, so never hand out the cached frame
+        return cached_dataset(filename).copy()
+
+    key = dataset_key(filename)
+    columns = tuple(dict.fromkeys(columns)) if columns is not None else None
+    df = DATASET_CACHE.get(key + (columns, compact))
+    if df is None:
+        full = DATASET_CACHE.get(key)
+        if full is not None:
+            df = full.copy() if columns is None else full[[c for c in full.columns if c in columns]].copy()
+        else:
+            df = read_dataset(key[0], columns)
+        if compact:
+            df = compact_frame(df)
+        df = DATASET_CACHE.set(key + (columns, compact), df)
+    return df.copy()
+
+
+def fitted_lambdas(filename, df, normalization, validated):
+    """Yeo-Johnson lambdas of the numeric columns of `df` (the dataset as
+    prepared before the transform) from the catalog. Columns without one are
+    fitted on `df` and stored, so each is only ever fitted once."""
+    key = '{}|{}'.format(normalization, validated)
+    lambdas = catalog.lambdas(filename, key)
+    missing = [column for column in df.select_dtypes(include=[np.number]).columns if column not in lambdas]
+    if missing:
+        with timed('power_transform_fit'):
+            fitted = yeo_johnson_lambdas(df[missing])
+        catalog.store_lambdas(filename, key, fitted)
+        lambdas.update(fitted)
+    return lambdas
+
+
+def load_prepared(filename, normalization='None', transformation='None', validated=False,
+                  columns=None, compact=False):
+    """Dataset with locations validated (if asked) then normalized and power
+    transformed as selected in the dashboard menu.
+
+    With `columns` only those are prepared (with the location and year
+    columns if validated); every step works column by column, so the values
+    are the same as when preparing the whole dataset."""
+    if columns is not None:
+        columns = projection(filename, columns, validated)
+    if not validated and normalization == 'None' and transformation == 'None':
+        return load_dataset(filename, columns, compact)
+
+    key = (dataset_key(filename), validated, normalization, transformation, columns, compact)
+    df = DERIVED_CACHE.get(key)
+    if df is None:
+        full = DERIVED_CACHE.get(key[:4] + (None, False)) if columns is not None else None
+        if compact:
+            df = compact_frame(load_prepared(filename, normalization, transformation, validated, columns))
+        elif full is not None:
+            # the validator adds these two
+            df = full[[c for c in full.columns if c in columns or c in ('Dataset Index', 'Data Year')]]
+        # build on the next step down the chain so that is cached as well
+        elif transformation != 'None':
+            df = load_prepared(filename, normalization, 'None', validated, columns)
+            lambdas = fitted_lambdas(filename, df, normalization, validated)
+            with timed('power_transform'):
+                df = power_transform(df, lambdas)
+        elif normalization != 'None':
+            df = load_prepared(filename, 'None', 'None', validated, columns)
+            with timed('normalize'):
+                df = normalize(df, normalization)
+        else:
+            df = load_dataset(filename, columns)
+            with timed('validate'):
+                df = Validator([df]).validate()
+        df = DERIVED_CACHE.set(key, df)
+    return df.copy()
+
+
+def load_summary(filename, normalization='None', transformation='None', validated=False):
+    """stats.summary_statistics of the prepared dataset, computed once."""
+    key = (dataset_key(filename), validated, normalization, transformation)
+    summary = SUMMARY_CACHE.get(key)
+    if summary is None:
+        df = load_prepared(filename, normalization, transformation, validated)
+        with timed('summary_statistics'):
+            summary = SUMMARY_CACHE.set(key, summary_statistics(df))
+    return summary
+
+
+def load_correlations(filename, normalization='None', transformation='None', validated=False):
+    """stats.correlation_matrices of the prepared dataset, computed once.
+    Kendall's tau is added under 'kendall' as pairs are asked for."""
+    key = (dataset_key(filename), validated, normalization, transformation)
+    correlations = CORRELATION_CACHE.get(key)
+    if correlations is None:
+        df = load_prepared(filename, normalization, transformation, validated)
+        with timed('correlations'):
+            correlations = correlation_matrices(df)
+        correlations['kendall'] = {}
+        correlations = CORRELATION_CACHE.set(key, correlations)
+    return correlations
+
+
+def load_kendall(filename, x_variable, y_variable, normalization='None', transformation='None', validated=False):
+    kendall = load_correlations(filename, normalization, transformation, validated)['kendall']
+    pair = tuple(sorted((x_variable, y_variable)))
+    if pair not in kendall:
+        df = load_prepared(filename, normalization, transformation, validated, columns=pair)
+        with timed('kendall'):
+            kendall[pair] = kendall_tau(df[pair[0]], df[pair[1]])
+    return kendall[pair]
+
+
+def load_fit(filename, x_variable, y_variable, method, normalization='None', transformation='None',
+             validated=False, exact=False):
+    """regression.fit of y on x in the prepared dataset, computed once."""
+    key = (dataset_key(filename), validated, normalization, transformation, x_variable, y_variable, method, exact)
+    result = FIT_CACHE.get(key)
+    if result is None:
+        df = load_prepared(filename, normalization, transformation, validated, columns=[x_variable, y_variable])
+        with timed('regression'):
+            result = FIT_CACHE.set(key, fit(df[x_variable], df[y_variable], method, exact))
+    return result
+
+
+def cached_figure(builder, filename, normalization, transformation, *args, validated=False,
+                  columns=None, compact=False):
+    """Figure returned by graphs.`builder`(prepared dataset, *args), serialized
+    to JSON and kept in the shared figure cache for CACHE_TIMEOUT_S.
+
+    The dataset's (path, mtime, size) is part of the key, so rewriting the file
+    leaves the old figures to expire instead of being served."""
+    key = (dataset_key(filename), validated, normalization, transformation, columns, compact,
+           builder.__name__, args)
+    key = 'figure-' + hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    fig_json = cache.get(key)
+    if fig_json is None:
+        FIGURE_CACHE_STATS['misses'] += 1
+        df = load_prepared(filename, normalization, transformation, validated, columns, compact)
+        with timed('figure_build'):
+            fig = builder(df, *args)
+        with timed('json_serialization'):
+            fig_json = fig.to_json()
+        cache.set(key, fig_json)
+    else:
+        FIGURE_CACHE_STATS['hits'] += 1
+    return json.loads(fig_json)
+
+
+class Dashboard(object):
+    """Frames shared by every panel built for one "create dashboard" click.
+
+    The validated frame is only prepared when a panel asks for it, so a
+    dataset without location columns still gets its stats and graphs.
+    """
+
+    def __init__(self, filename, normalization, transformation):
+        self.filename = filename
+        self.normalization = normalization
+        self.transformation = transformation
+        self.df = load_prepared(filename, normalization, transformation)
+        self._validated_df = None
+
+    @property
+    def validated_df(self):
+        if self._validated_df is None:
+            self._validated_df = load_prepared(self.filename, self.normalization,
+                                               self.transformation, validated=True)
+        return self._validated_df
+
+    @property
+    def summary(self):
+        return load_summary(self.filename, self.normalization, self.transformation)
+
+    # correlations are taken over the validated locations
+    @property
+    def correlations(self):
+        return load_correlations(self.filename, self.normalization, self.transformation, validated=True)
+
+    def figure(self, builder, *args, validated=False):
+        return cached_figure(builder, self.filename, self.normalization, self.transformation,
+                             *args, validated=validated)
+
+    def kendall(self, x_variable, y_variable):
+        return load_kendall(self.filename, x_variable, y_variable,
+                            self.normalization, self.transformation, validated=True)
+
+    def fit(self, x_variable, y_variable, method='ols'):
+        return load_fit(self.filename, x_variable, y_variable, method,
+                        self.normalization, self.transformation, validated=True)
+
+
+def invalidate_dataset(filename):
+    path = os.path.abspath(os.path.join(DATASETS_PATH, filename))
+    DATASET_CACHE.discard(lambda key: key[0] == path)
+    DERIVED_CACHE.discard(lambda key: key[0][0] == path)
+    SUMMARY_CACHE.discard(lambda key: key[0][0] == path)
+    CORRELATION_CACHE.discard(lambda key: key[0][0] == path)
+    FIT_CACHE.discard(lambda key: key[0][0] == path)
@@ -2,12 +2,22 @@ import dash_core_components as dcc
 import dash_html_components as html
 import uiCallbacks
 import graphCallbacks
+import dashboardCallbacks
+import upload
+import download
+import metrics
 from dash.dependencies import Input, Output, State
 from app import app
 from layout import serve_layout
+from columnar import build_sidecars
+import catalog
 
 
 app.layout = serve_layout
+# columnar copies of the bundled datasets, rebuilt only when stale
+build_sidecars()
+# ... and the metadata the menus are listed from
+catalog.refresh()
 # need to expose server object for gunicorn
 application = app.server
 
@@ -0,0 +1,259 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from app import JOB_PATH, JOB_WORKERS, JOB_EXPIRY_S, JOB_POLL_MS
+
+# Each job has a directory in JOB_PATH named after its id, holding
+#   status.json  state ('queued', 'running', 'done', 'failed' or 'cancelled'),
+#                progress, message and the pid of the process handling it
+#   result.pkl   the pickled return value, once done
+#   cancel       present if the job was cancelled
+#   watchers/    a file per session polling the job, touched on every poll
+# so every worker can poll, cancel or reuse a job whichever worker started it.
+
+# a session that hasn't polled for this long has stopped waiting for the job
+WATCHER_EXPIRY_S = max(10, 5 * JOB_POLL_MS / 1000)
+
+_pool = None
+_pool_pid = None
+_futures = {}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def job_dir(job_id):
+    return os.path.join(JOB_PATH, job_id)
+
+
+def job_id(func, args):
+    """Identical calls get the same id, so they share one job."""
+    key = (func.__module__, func.__qualname__, args)
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+def write_status(job_id, **status):
+    status['updated'] = time.time()
+    fd, tmp = tempfile.mkstemp(dir=job_dir(job_id), suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as file:
+        json.dump(status, file)
+    os.replace(tmp, os.path.join(job_dir(job_id), 'status.json'))
+
+
+def status(job_id):
+    """The job's status, with a queued or running job that can no longer
+    finish reported (and recorded) as failed."""
+    try:
+        with open(os.path.join(job_dir(job_id), 'status.json'), encoding='utf-8') as file:
+            current = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if current['state'] in ('queued', 'running'):
+        message = _lost(job_id, current)
+        if message is not None:
+            current.update(state='failed', progress=0, message=message)
+            try:
+                write_status(job_id, **current)
+            except OSError:
+                pass
+    return current
+
+
+def _lost(job_id, current):
+    # why the job will never finish, or None if it still can
+    future = _futures.get(job_id)
+    if future is not None and future.done() and not future.cancelled() and future.exception() is not None:
+        error = future.exception()
+        return str(error) or repr(error)
+    if not _alive(current['pid']):
+        return 'The process running the job stopped'
+    return None
+
+
+def cancelled(job_id):
+    return os.path.exists(os.path.join(job_dir(job_id), 'cancel'))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _reusable(current):
+    # a finished job, or one still queued/running in a live process
+    if current is None:
+        return False
+    if current['state'] == 'done':
+        return True
+    return current['state'] in ('queued', 'running') and _alive(current['pid'])
+
+
+def _pool_for_process(broken=False):
+    global _pool, _pool_pid
+    # a pool can't be carried over into forked workers, nor used again once
+    # one of its processes has died
+    if _pool is None or _pool_pid != os.getpid() or broken:
+        if _pool_pid != os.getpid():
+            _futures.clear()
+        # forking a threaded worker can copy a lock another thread holds
+        _pool = ProcessPoolExecutor(max_workers=JOB_WORKERS,
+                                    mp_context=multiprocessing.get_context('spawn'))
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def prune():
+    cutoff = time.time() - JOB_EXPIRY_S
+    for name in os.listdir(JOB_PATH):
+        try:
+            if os.path.getmtime(os.path.join(job_dir(name), 'status.json')) < cutoff:
+                shutil.rmtree(job_dir(name), ignore_errors=True)
+        except OSError:
+            pass
+
+
+def submit(func, *args):
+    """Run func(*args, progress=...) in the process pool and return the job id.
+
+    If an identical job is queued, running or done its id is returned rather
+    than starting another; `args` should include anything, such as a dataset's
+    mtime, that changes the result."""
+    os.makedirs(JOB_PATH, exist_ok=True)
+    prune()
+    new_id = job_id(func, args)
+
+    for _ in range(2):
+        try:
+            # whoever creates the directory owns the job
+            os.mkdir(job_dir(new_id))
+            break
+        except FileExistsError:
+            current = status(new_id)
+            if _reusable(current) or (current is None and _recent(new_id)):
+                return new_id
+            shutil.rmtree(job_dir(new_id), ignore_errors=True)
+
+    write_status(new_id, state='queued', progress=0, message='Queued', pid=os.getpid())
+    for done in [key for key, future in _futures.items() if future.done()]:
+        del _futures[done]
+    try:
+        _futures[new_id] = _pool_for_process().submit(run, new_id, func, args)
+    except BrokenProcessPool:
+        _futures[new_id] = _pool_for_process(broken=True).submit(run, new_id, func, args)
+    return new_id
+
+
+def _recent(job_id):
+    # the directory was just claimed and its status isn't written yet
+    try:
+        return time.time() - os.path.getmtime(job_dir(job_id)) < 5
+    except OSError:
+        return False
+
+
+class Progress(object):
+    """Passed to jobs as `progress`; call it between stages of the work."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def __call__(self, fraction, message):
+        if cancelled(self.job_id):
+            raise JobCancelled
+        write_status(self.job_id, state='running', progress=fraction, message=message, pid=os.getpid())
+
+
+def run(job_id, func, args):
+    # runs in a pool process
+    if cancelled(job_id):
+        return
+    try:
+        write_status(job_id, state='running', progress=0, message='Starting', pid=os.getpid())
+        result = func(*args, progress=Progress(job_id))
+
+        fd, tmp = tempfile.mkstemp(dir=job_dir(job_id), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as file:
+            pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, os.path.join(job_dir(job_id), 'result.pkl'))
+
+        if not cancelled(job_id):
+            write_status(job_id, state='done', progress=1, message='Done', pid=os.getpid())
+    except JobCancelled:
+        pass
+    except Exception as error:
+        traceback.print_exc()
+        write_status(job_id, state='failed', progress=0, message=str(error) or repr(error), pid=os.getpid())
+
+
+def result(job_id):
+    with open(os.path.join(job_dir(job_id), 'result.pkl'), 'rb') as file:
+        return pickle.load(file)
+
+
+def watch(job_id, watcher):
+    """Note that the session `watcher` is still waiting for the job."""
+    directory = os.path.join(job_dir(job_id), 'watchers')
+    try:
+        # not makedirs, a pruned job shouldn't come back without its status
+        os.mkdir(directory)
+    except FileExistsError:
+        pass
+    except OSError:
+        return
+    try:
+        open(os.path.join(directory, watcher), 'w').close()
+    except OSError:
+        pass
+
+
+def _other_watchers(job_id, watcher):
+    directory = os.path.join(job_dir(job_id), 'watchers')
+    cutoff = time.time() - WATCHER_EXPIRY_S
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    others = []
+    for name in names:
+        try:
+            if name != watcher and os.path.getmtime(os.path.join(directory, name)) >= cutoff:
+                others.append(name)
+        except OSError:
+            pass
+    return others
+
+
+def cancel(job_id, watcher=None):
+    """Stop `watcher` waiting for the job, and cancel the job unless other
+    sessions are still waiting for it. Returns whether it was cancelled."""
+    if watcher is not None:
+        try:
+            os.unlink(os.path.join(job_dir(job_id), 'watchers', watcher))
+        except OSError:
+            pass
+        if _other_watchers(job_id, watcher):
+            return False
+    try:
+        open(os.path.join(job_dir(job_id), 'cancel'), 'w').close()
+        write_status(job_id, state='cancelled', progress=0, message='Cancelled', pid=os.getpid())
+    except OSError:
+        return False
+    future = _futures.pop(job_id, None)
+    if future is not None:
+        future.cancel()
+    return True
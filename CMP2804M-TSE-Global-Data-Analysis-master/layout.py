@@ -1,9 +1,9 @@
-import os
 import dash_core_components as dcc
 import dash_html_components as html
 import pandas as pd
 import plotly.graph_objects as go
-from app import DATASETS_PATH
+from app import UPLOAD_INLINE_MAX_BYTES
+import catalog
 
 
 # Serve page layout
@@ -24,13 +24,20 @@ def serve_layout():
                             html.A('Select File to upload')
                         ]),
                         # Do NOT Allow SIMULTANEOUS uploads by the user
-                        multiple=False
+                        multiple=False,
+                        # anything bigger is streamed with the input below
+                        max_size=UPLOAD_INLINE_MAX_BYTES
                     ),
+                    # Large files, sent to /upload by assets/upload.js
+                    html.Div(id='stream-upload-area', children=[
+                        html.Button('Upload a large file', id='stream-upload'),
+                        html.Div(id='stream-upload-progress')
+                    ]),
                     # List all .csv  files hosted on the server
                     html.Div(id='file-list',
                         children=[dcc.Dropdown(id='files', options=[
                             {'label': filename,'value': filename} for filename in
-                            sorted(os.listdir(DATASETS_PATH))],
+                            catalog.datasets()],
                             placeholder="Select Dataset"),
                         ]),
                     html.Button('Populate menu', id='show-dashboard-opts'),
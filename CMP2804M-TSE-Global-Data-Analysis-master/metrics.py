@@ -0,0 +1,124 @@
+import os
+import time
+from flask import Response, g, has_request_context, request
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from app import app
+
+# Served at /metrics in the Prometheus text format. Under gunicorn, set the
+# prometheus_multiproc_dir environment variable to an empty directory so
+# every worker's counts are combined (and call
+# prometheus_client.multiprocess.mark_process_dead from gunicorn's child_exit
+# hook). Cache statistics are per process and come from the worker serving
+# the scrape.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1e3, 1e4, 5e4, 1e5, 5e5, 1e6, 5e6, 1e7, 5e7, 1e8)
+
+REQUESTS = Counter('gdat_requests_total', 'Requests by callback (or route) and status',
+                   ['callback', 'status'])
+REQUEST_SECONDS = Histogram('gdat_request_seconds', 'Request latency by callback (or route)',
+                            ['callback'], buckets=LATENCY_BUCKETS)
+RESPONSE_BYTES = Histogram('gdat_response_bytes', 'Response body size by callback (or route)',
+                           ['callback'], buckets=SIZE_BUCKETS)
+STAGE_SECONDS = Histogram('gdat_stage_seconds', 'Time spent in each stage of the data pipeline, by callback',
+                          ['callback', 'stage'], buckets=LATENCY_BUCKETS)
+
+# name: function returning a dict of counts, see watch
+_watched = {}
+# functions returning compact_frame's counts, see watch_compaction
+_compaction = []
+
+
+def timed(stage):
+    """Context manager timing a pipeline stage, e.g. `with timed('normalize'):`.
+    Stages run in the jobs pool have no request and are labelled 'job'."""
+    name = callback_name() if has_request_context() else 'job'
+    return STAGE_SECONDS.labels(name, stage).time()
+
+
+def watch(name, stats):
+    """Report `stats()` (a dict with 'hits', 'misses' and optionally
+    'evictions', 'entries' and 'bytes') as the cache `name`."""
+    _watched[name] = stats
+
+
+def watch_compaction(stats):
+    """Report `stats()` (a dict with 'frames', 'bytes_before' and
+    'bytes_after') as the memory saved by compacting frames."""
+    _compaction.append(stats)
+
+
+class CacheCollector(object):
+    def collect(self):
+        hits = CounterMetricFamily('gdat_cache_hits', 'Cache hits', labels=['cache'])
+        misses = CounterMetricFamily('gdat_cache_misses', 'Cache misses', labels=['cache'])
+        evictions = CounterMetricFamily('gdat_cache_evictions', 'Cache evictions', labels=['cache'])
+        entries = GaugeMetricFamily('gdat_cache_entries', 'Entries in the cache', labels=['cache'])
+        nbytes = GaugeMetricFamily('gdat_cache_bytes', 'Bytes held by the cache', labels=['cache'])
+        ratio = GaugeMetricFamily('gdat_cache_hit_ratio', 'Hits over lookups since start', labels=['cache'])
+
+        for name, stats in sorted(_watched.items()):
+            stats = stats()
+            hits.add_metric([name], stats['hits'])
+            misses.add_metric([name], stats['misses'])
+            lookups = stats['hits'] + stats['misses']
+            ratio.add_metric([name], stats['hits'] / lookups if lookups else 0)
+            if 'evictions' in stats:
+                evictions.add_metric([name], stats['evictions'])
+            if 'entries' in stats:
+                entries.add_metric([name], stats['entries'])
+            if 'bytes' in stats:
+                nbytes.add_metric([name], stats['bytes'])
+
+        frames = CounterMetricFamily('gdat_compacted_frames', 'Frames compacted to smaller dtypes')
+        saved = CounterMetricFamily('gdat_compaction_saved_bytes', 'Bytes saved by compacting frames')
+        for stats in _compaction:
+            stats = stats()
+            frames.add_metric([], stats['frames'])
+            saved.add_metric([], stats['bytes_before'] - stats['bytes_after'])
+
+        return [hits, misses, evictions, entries, nbytes, ratio, frames, saved]
+
+
+REGISTRY.register(CacheCollector())
+
+
+def callback_name():
+    # Dash posts every callback to one route, named here by its outputs
+    if request.path.endswith('_dash-update-component'):
+        payload = request.get_json(silent=True) or {}
+        return payload.get('output', 'unknown').strip('.')
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+@app.server.before_request
+def start_timer():
+    g.metrics_start = time.time()
+
+
+@app.server.after_request
+def record_request(response):
+    if 'metrics_start' not in g:
+        return response
+
+    name = callback_name()
+    REQUESTS.labels(name, str(response.status_code)).inc()
+    REQUEST_SECONDS.labels(name).observe(time.time() - g.metrics_start)
+    # streamed responses (downloads) have no length up front
+    if response.content_length is not None:
+        RESPONSE_BYTES.labels(name).observe(response.content_length)
+    return response
+
+
+@app.server.route('/metrics')
+def metrics():
+    if 'prometheus_multiproc_dir' in os.environ:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        # per-process cache statistics can't be combined, report this worker's
+        registry.register(CacheCollector())
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
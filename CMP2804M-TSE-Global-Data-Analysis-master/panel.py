@@ -0,0 +1,136 @@
+import re
+from collections import namedtuple
+import threading
+import numpy as np
+import pandas as pd
+from app import PANEL_FILE_PATTERN
+from cache import LRUCache
+import catalog
+from helpers import dataset_key, load_dataset
+from validator import Validator, align_columns
+
+
+# Per-year arrays for an animated choropleth of one indicator, with the colour
+# range shared by every year
+ChoroplethFrames = namedtuple('ChoroplethFrames', ['years', 'locations', 'z', 'zmin', 'zmax'])
+
+
+class Panel(object):
+    """Every yearly dataset matching `pattern` as one frame indexed by
+    (location, year), with a column per indicator.
+
+    `location` is the value from each file's country column and the
+    `country` column holds its unified name from Validator. Files are
+    validated once; adding a year only validates and appends that file.
+    Indicator names follow the widest year's headers, as in Validator.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = re.compile(pattern)
+        self.pieces = {}
+        self.frame = None
+        self.reference = ()
+        self.version = 0
+        self.frames_cache = LRUCache(max_entries=64)
+        self._lock = threading.Lock()
+
+    def _piece(self, filename):
+        df = load_dataset(filename)
+        validator = Validator([df])
+        cdf = validator.validate()
+        cdf = cdf[cdf['Data Year'].notna()]
+
+        piece = cdf.drop(columns=['Dataset Index', 'Data Year',
+                                  validator.year_column, validator.country_column])
+        piece.insert(0, 'country', cdf[validator.country_column])
+        piece.index = pd.MultiIndex.from_arrays(
+            [df.loc[cdf.index, validator.country_column].values, cdf['Data Year'].astype(int).values],
+            names=['location', 'year'])
+        return piece
+
+    def _reference(self, filenames):
+        # the widest year's headers, picked as Validator.match_columns does
+        reference = ()
+        for filename in filenames:
+            columns = tuple(self.pieces[filename][1].columns)
+            if len(columns) > len(reference):
+                reference = columns
+        return reference
+
+    def _aligned(self, filename):
+        # indicators renamed to their equivalent in the reference, unmatched ones kept
+        piece = self.pieces[filename][1]
+        return piece.rename(columns=dict(align_columns(self.reference, tuple(piece.columns))))
+
+    def refresh(self):
+        """Bring the panel up to date with the datasets directory and return it."""
+        with self._lock:
+            filenames = [f for f in catalog.datasets() if self.pattern.match(f)]
+            keys = {filename: dataset_key(filename) for filename in filenames}
+
+            stale = [f for f in self.pieces if keys.get(f) != self.pieces[f][0]]
+            for filename in stale:
+                del self.pieces[filename]
+
+            added = []
+            for filename in filenames:
+                if filename not in self.pieces:
+                    self.pieces[filename] = (keys[filename], self._piece(filename))
+                    added.append(filename)
+
+            # a new widest year changes the names every year is aligned to
+            reference = self._reference(filenames)
+            if stale or self.frame is None or reference != self.reference:
+                self.reference = reference
+                pieces = [self._aligned(f) for f in filenames]
+                self.frame = pd.concat(pieces, sort=False).sort_index() if pieces else None
+                self.version += 1
+            elif added:
+                pieces = [self.frame] + [self._aligned(f) for f in added]
+                self.frame = pd.concat(pieces, sort=False).sort_index()
+                self.version += 1
+            return self.frame
+
+    def years(self):
+        frame = self.refresh()
+        return [] if frame is None else sorted(frame.index.unique(level='year'))
+
+    def slice(self, years=None, indicators=None, locations=None):
+        """Rows for the given years/locations and the given indicator columns
+        (plus `country`), each defaulting to everything."""
+        frame = self.refresh()
+        if frame is None:
+            return None
+
+        rows = pd.IndexSlice[
+            slice(None) if locations is None else list(locations),
+            slice(None) if years is None else list(years)]
+        columns = slice(None) if indicators is None else ['country'] + list(indicators)
+        return frame.loc[rows, columns]
+
+
+    def choropleth_frames(self, indicator):
+        """Locations and values of `indicator` for every year, or None if the
+        panel doesn't have it."""
+        frame = self.refresh()
+        if frame is None or indicator not in frame.columns:
+            return None
+
+        key = (self.version, indicator)
+        frames = self.frames_cache.get(key)
+        if frames is None:
+            data = frame[['country', indicator]].dropna()
+            data = data[pd.to_numeric(data[indicator], errors='coerce').notna()]
+            years = sorted(data.index.unique(level='year'))
+            groups = {year: group for year, group in data.groupby(level='year')}
+            values = data[indicator].astype(float)
+            frames = self.frames_cache.set(key, ChoroplethFrames(
+                years=years,
+                locations=[groups[year]['country'].to_numpy() for year in years],
+                z=[groups[year][indicator].astype(float).to_numpy() for year in years],
+                zmin=float(values.min()) if len(values) else np.nan,
+                zmax=float(values.max()) if len(values) else np.nan))
+        return frames
+
+
+panel = Panel(PANEL_FILE_PATTERN)
@@ -0,0 +1,82 @@
+from collections import namedtuple
+import numpy as np
+from scipy.stats import t as t_distribution
+from statsmodels.nonparametric.smoothers_lowess import lowess as statsmodels_lowess
+
+# Above this many points LOWESS is fitted to equal-count bin means instead
+LOWESS_MAX_POINTS = 2000
+# statsmodels' (and plotly express') default smoothing span
+LOWESS_FRAC = 2 / 3
+
+
+class Fit(namedtuple('Fit', ['method', 'exact', 'n', 'slope', 'intercept', 'r_squared', 'p_value', 'x', 'y'])):
+    """A trendline through (x, y) plus the OLS statistics of the points.
+
+    The repr leaves out the curve so it can be part of a cache key.
+    """
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'Fit(method={!r}, exact={!r}, n={!r}, slope={!r}, intercept={!r})'.format(
+            self.method, self.exact, self.n, self.slope, self.intercept)
+
+
+def _complete(x, y):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    present = np.isfinite(x) & np.isfinite(y)
+    return x[present], y[present]
+
+
+def _ols(x, y):
+    """Closed-form least squares: (slope, intercept, r squared, p-value of the slope)."""
+    n = len(x)
+    if n < 3:
+        return np.nan, np.nan, np.nan, np.nan
+
+    x_mean, y_mean = x.mean(), y.mean()
+    dx, dy = x - x_mean, y - y_mean
+    sxx, syy, sxy = dx @ dx, dy @ dy, dx @ dy
+    if sxx == 0:
+        return np.nan, np.nan, np.nan, np.nan
+
+    slope = sxy / sxx
+    intercept = y_mean - slope * x_mean
+    r_squared = sxy * sxy / (sxx * syy) if syy != 0 else 1.0
+    if r_squared >= 1:
+        return slope, intercept, 1.0, 0.0
+
+    t = np.sqrt(r_squared * (n - 2) / (1 - r_squared))
+    return slope, intercept, r_squared, 2 * t_distribution.sf(t, n - 2)
+
+
+def _binned_means(x, y, bins):
+    # sort by x and average equal-count runs of points, so each bin carries the same weight
+    order = np.argsort(x, kind='mergesort')
+    starts = np.linspace(0, len(x), bins, endpoint=False).astype(int)
+    counts = np.diff(np.append(starts, len(x)))
+    return np.add.reduceat(x[order], starts) / counts, np.add.reduceat(y[order], starts) / counts
+
+
+def fit(x, y, method='ols', exact=False):
+    """Fit an 'ols' or 'lowess' trendline through the rows where both x and
+    y are present. LOWESS is fitted on binned means for large inputs unless
+    `exact` is set."""
+    x, y = _complete(x, y)
+    n = len(x)
+    slope, intercept, r_squared, p_value = _ols(x, y)
+
+    if n == 0:
+        curve_x, curve_y = x, y
+    elif method == 'ols':
+        curve_x = np.array([x.min(), x.max()])
+        curve_y = intercept + slope * curve_x
+    elif method == 'lowess':
+        if not exact and n > LOWESS_MAX_POINTS:
+            x, y = _binned_means(x, y, LOWESS_MAX_POINTS)
+        curve = statsmodels_lowess(y, x, frac=LOWESS_FRAC)
+        curve_x, curve_y = curve[:, 0], curve[:, 1]
+    else:
+        raise ValueError("`method` needs to be either 'ols' or 'lowess'.")
+
+    return Fit(method, exact, n, slope, intercept, r_squared, p_value, curve_x, curve_y)
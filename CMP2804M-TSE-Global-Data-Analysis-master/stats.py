@@ -1,5 +1,6 @@
 import pandas as pd
 import numpy as np
+from scipy.stats import kendalltau
 from sklearn.preprocessing import PowerTransformer
 
 
@@ -15,9 +16,149 @@ def normalize(df, norm_type):
     return df
 
 
-def power_transform(df):
+def yeo_johnson_lambdas(df):
+    """Fitted Yeo-Johnson lambda of each numeric column of `df`."""
     df_num = df.select_dtypes(include=[np.number])
-    transformer = PowerTransformer(standardize = False)
-    df_num = pd.DataFrame(transformer.fit_transform(df_num), columns = df_num.columns)
-    df[df_num.columns] = df_num
+    transformer = PowerTransformer(standardize = False).fit(df_num)
+    return dict(zip(df_num.columns, transformer.lambdas_.tolist()))
+
+
+def yeo_johnson(values, lmbda):
+    """Yeo-Johnson transform of `values` with a known lambda, exactly as
+    PowerTransformer applies it (NaNs stay NaN)."""
+    values = np.asarray(values, dtype=float)
+    out = np.full_like(values, np.nan)
+
+    # comparisons with NaN warn on older numpy
+    with np.errstate(invalid='ignore'):
+        pos = values >= 0
+        neg = values < 0
+        if abs(lmbda) < np.spacing(1.):
+            out[pos] = np.log1p(values[pos])
+        else:
+            out[pos] = (np.power(values[pos] + 1, lmbda) - 1) / lmbda
+        if abs(lmbda - 2) > np.spacing(1.):
+            out[neg] = -(np.power(-values[neg] + 1, 2 - lmbda) - 1) / (2 - lmbda)
+        else:
+            out[neg] = -np.log1p(-values[neg])
+    return out
+
+
+def power_transform(df, lambdas=None):
+    """Yeo-Johnson transform every numeric column of `df` in place.
+
+    `lambdas` maps columns to lambdas fitted earlier (see
+    yeo_johnson_lambdas); columns without one are fitted here."""
+    df_num = df.select_dtypes(include=[np.number])
+    lambdas = dict(lambdas or {})
+    missing = [column for column in df_num.columns if column not in lambdas]
+    if missing:
+        lambdas.update(yeo_johnson_lambdas(df_num[missing]))
+    for column in df_num.columns:
+        df[column] = yeo_johnson(df_num[column].to_numpy(dtype=float), lambdas[column])
     return df
+
+
+SUMMARY_STATISTICS = ['Minimum', 'Maximum', 'Mean', 'Median', 'Skewness', 'Kurtosis',
+                      'Standard Deviation', 'Variance', 'Q1', 'Q3', 'IQR']
+
+
+def quantitative(df):
+    """The columns the dashboard offers as quantitative (is_numeric_dtype,
+    so bools too) as floats, bools counting as 0/1."""
+    return df.select_dtypes(include=[np.number, bool]).astype(float)
+
+
+def _zero_small(values):
+    # same floating point clean-up pandas does before skew/kurtosis
+    return np.where(np.abs(values) < 1e-14, 0, values)
+
+
+def _quantiles(values, n, qs):
+    """Linearly interpolated quantiles `qs` of each row of `values`, which
+    has its n[i] valid entries first once NaNs are pushed to the end."""
+    result = np.full((len(qs), len(values)), np.nan)
+    qs = np.asarray(qs, dtype=float)
+
+    for idx, row in enumerate(values):
+        count = int(n[idx])
+        if count == 0:
+            continue
+        position = qs * (count - 1)
+        below = np.floor(position).astype(int)
+        above = np.ceil(position).astype(int)
+        # only the ranks we need are put in place, no full sort
+        ranked = np.partition(row, np.unique(np.concatenate([below, above])))
+        result[:, idx] = ranked[below] + (ranked[above] - ranked[below]) * (position - below)
+    return result
+
+
+def summary_statistics(df):
+    """Every SUMMARY_STATISTICS measure for all quantitative columns of `df` at once.
+
+    Matches the pandas Series methods (NaNs skipped, sample variance,
+    bias-corrected skewness/kurtosis, linearly interpolated quartiles).
+    Returns a DataFrame indexed by column name.
+    """
+    df_num = quantitative(df)
+    # one contiguous row per column keeps every reduction cache friendly
+    values = np.ascontiguousarray(df_num.to_numpy().T)
+    valid = ~np.isnan(values)
+    n = valid.sum(axis=1).astype(float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(valid, values, 0).sum(axis=1) / n
+        centred = np.where(valid, values - mean[:, None], 0)
+        centred2 = centred ** 2
+        m2 = _zero_small(centred2.sum(axis=1))
+        m3 = _zero_small((centred2 * centred).sum(axis=1))
+        m4 = _zero_small((centred2 ** 2).sum(axis=1))
+
+        variance = np.where(n > 1, m2 / (n - 1), np.nan)
+        skewness = np.where(m2 == 0, 0, n * (n - 1) ** 0.5 / (n - 2) * m3 / m2 ** 1.5)
+        skewness = np.where(n < 3, np.nan, skewness)
+        kurtosis = (n * (n + 1) * (n - 1) * m4) / ((n - 2) * (n - 3) * m2 ** 2) \
+            - 3 * (n - 1) ** 2 / ((n - 2) * (n - 3))
+        kurtosis = np.where(m2 == 0, 0, kurtosis)
+        kurtosis = np.where(n < 4, np.nan, kurtosis)
+
+        # NaNs partition to the end, so the extremes come out with the quartiles
+        minimum, q1, median, q3, maximum = _quantiles(values, n, (0, 0.25, 0.5, 0.75, 1))
+
+        summary = pd.DataFrame({
+            'Minimum': minimum,
+            'Maximum': maximum,
+            'Mean': mean,
+            'Median': median,
+            'Skewness': skewness,
+            'Kurtosis': kurtosis,
+            'Standard Deviation': np.sqrt(variance),
+            'Variance': variance,
+            'Q1': q1,
+            'Q3': q3,
+            'IQR': q3 - q1,
+        }, index=df_num.columns, columns=SUMMARY_STATISTICS)
+    return summary
+
+
+def correlation_matrices(df):
+    """Pairwise Pearson and Spearman correlation and covariance matrices of
+    the quantitative columns, each pair using the rows where both are present."""
+    df_num = quantitative(df)
+    return {
+        'pearson': df_num.corr(method='pearson'),
+        'spearman': df_num.corr(method='spearman'),
+        'covariance': df_num.cov(),
+    }
+
+
+def kendall_tau(x, y):
+    """Kendall's tau-b of two Series over the rows where both are present.
+
+    scipy counts discordant pairs by merge sort, O(n log n) rather than
+    comparing every pair of rows.
+    """
+    valid = x.notna().to_numpy() & y.notna().to_numpy()
+    if valid.sum() < 2:
+        return np.nan
+    return kendalltau(x.to_numpy()[valid], y.to_numpy()[valid])[0]
@@ -6,13 +6,15 @@ import dash_table as dt
 from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
 from pandas.api.types import is_numeric_dtype
-from app import app, DATASETS_PATH
-from helpers import parse_file_to_df
+from app import app, JOB_POLL_MS, PREVIEW_PAGE_SIZE
+from helpers import cached_dataset
+from download import preview_page
+import catalog
 from graphs import *
+from panel import panel
 from six.moves.urllib.parse import quote
 from stats import *
-from pathlib import Path
-from validator import Validator
+from upload import save_contents, UploadError
 
 
 @app.callback(Output('file-list', 'children'),
@@ -23,29 +25,21 @@ def update_file_storage(contents, filename):
         raise PreventUpdate
     else:
         try:
-            df = parse_file_to_df(contents, filename)
-        except Exception:
-            return html.H4("Error: Incompatible filetype. Please upload a .csv file.")
-        validator = Validator([df])
-        validator.validate()
-
-        my_file = Path(os.path.join(DATASETS_PATH, filename))
-        if not my_file.is_file():
-            df.to_csv(my_file)
+            save_contents(contents, filename)
+        except UploadError as error:
             return [
+                html.H4("Error: {}".format(error)),
                 dcc.Dropdown(id='files',
                              options=[{'label': filename, 'value': filename}
-                                      for filename in sorted(os.listdir(DATASETS_PATH))],
-                             placeholder='Select dataset')
-            ]
-        else:
-            return [
-                html.H1("Error: File already exists on disk. Please change filename."),
-                dcc.Dropdown(id='files',
-                             options=[{'label': filename, 'value': filename}
-                                      for filename in sorted(os.listdir(DATASETS_PATH))],
+                                      for filename in catalog.datasets()],
                              placeholder='Select dataset')
             ]
+        return [
+            dcc.Dropdown(id='files',
+                         options=[{'label': filename, 'value': filename}
+                                  for filename in catalog.datasets()],
+                         placeholder='Select dataset')
+        ]
 
 
 @app.callback(Output('dashboard-creation-area', 'children'),
@@ -55,20 +49,26 @@ def populate_dashboard_menu(n_clicks, filename):
     if n_clicks is None:
         raise PreventUpdate
 
-    df = pd.read_csv(os.path.join(DATASETS_PATH, filename))
+    # column names come from the catalog, the dataset itself isn't read
+    entry = catalog.entry(filename)
+    if entry is None:
+        return html.H4("Error: Dataset not found, please select another.")
+    columns = entry['columns']
 
-    if 'Country Code' in df.columns:
+    if 'Country Code' in columns:
         country_dropdown_text = 'Country Code'
-    elif 'Country Names' in df.columns:
+    elif 'Country Names' in columns:
         country_dropdown_text = 'Country Names'
+    elif entry['country_column'] is not None:
+        country_dropdown_text = entry['country_column']
     else:
         country_dropdown_text = 'Select Country Names/Code column'
     return [
         dcc.Dropdown(id='x-variable-dropdown', options=[{'label': i, 'value': i}
-                                                        for i in sorted(df.columns)],
+                                                        for i in sorted(columns)],
                             placeholder='Select x variable'),
         dcc.Dropdown(id='y-variable-dropdown', options=[{'label': i, 'value': i}
-                                                        for i in sorted(df.columns)],
+                                                        for i in sorted(columns)],
                             placeholder='Select y variable (optional)'),
 
         dcc.RadioItems(id='normalization-radio',
@@ -87,9 +87,17 @@ def populate_dashboard_menu(n_clicks, filename):
             ],
             value='Transform'
         ),
+        # Animate the choropleth through every yearly dataset (raw values)
+        dcc.RadioItems(id='choropleth-mode-radio',
+            options=[
+                {'label': 'Map selected year', 'value': 'Single'},
+                {'label': 'Animate map through all years (untransformed values)', 'value': 'Animated'},
+            ],
+            value='Single'
+        ),
         # Dropdown for indicating where country information is located in df
         dcc.Dropdown(id='countries', options=[{'label': i, 'value': i}
-                                                for i in sorted(df.columns)],
+                                                for i in sorted(columns)],
                         value=country_dropdown_text),
 
         # Select colourscheme from list
@@ -98,124 +106,107 @@ def populate_dashboard_menu(n_clicks, filename):
                                  for colourscheme in sorted(CONTINUOUS_COLOUR_SCALES)],
                         placeholder='Select custom colour scheme for graphs (optional)'),
         # create dashboard
-        html.Button('Create Graphs/Analyze selected variables', id='create-dashboard')
+        html.Button('Create Graphs/Analyze selected variables', id='create-dashboard'),
+        # progress of the dashboard while it's built in the background, see dashboardCallbacks
+        dcc.Store(id='job'),
+        dcc.Interval(id='job-poll', interval=JOB_POLL_MS, disabled=True),
+        html.Div(id='job-area', children=[
+            html.Span(id='job-status'),
+            html.Button('Cancel', id='cancel-job')
+        ])
     ]
 
 
-@app.callback(Output('stats', 'children'),
-    [Input('create-dashboard', 'n_clicks')],
-    [State('x-variable-dropdown', 'value'), State('y-variable-dropdown', 'value'),
-    State('files', 'value'), State('normalization-radio','value'),
-    State('transformation-radio', 'value')])
-def update_summary_stats(n_clicks,
-                        x_variable,
-                        y_variable,
-                        filename,
-                        normalization,
-                        transformation):
-    if n_clicks is None:
-        raise PreventUpdate
-
-    df = pd.read_csv(os.path.join(DATASETS_PATH, filename))
-    # Apply normalization if selected (Min-Max or Z-Score)
-    if normalization != 'None':
-        df = normalize(df, normalization)
+# Summary statistics panel of the dashboard, see dashboardCallbacks.create_dashboard
+def summary_stats_panel(dashboard, x_variable, y_variable, transformation):
+    df = dashboard.df
     if transformation != 'None':
-        df = power_transform(df)
         transform_indicator_str = " power transformed to Gaussian distribution,"
     else:
         transform_indicator_str = ""
 
+    # every statistic is looked up from the precomputed summary of the dataset
+    summary = dashboard.summary
 
-    if x_variable is not None and is_numeric_dtype(df[x_variable]) and y_variable is not None and is_numeric_dtype(df[y_variable]):
-        return [
-            html.Ul(id='stats-list', children=[
-                html.H6("Summary statistics for" + transform_indicator_str + " X variable: {}".format(x_variable)),
-                html.Li("Minimum: {:0.2f}".format(df[x_variable].min())),
-                html.Li("Maximum: {:0.2f}".format(df[x_variable].max())),
-                html.Li("Mean: {:0.2f}".format(df[x_variable].mean())),
-                html.Li("Median: {:0.2f}".format(df[x_variable].median())),
-                html.Li("Skewness: {:0.2f}".format(df[x_variable].skew())),
-                html.Li("Kurtosis: {:0.2f}".format(df[x_variable].kurtosis())),
-                html.Li("Standard Deviation: {:0.2f}".format(df[x_variable].std())),
-                html.Li("Variance: {:0.2f}".format(df[x_variable].var())),
-                html.Li("Q1: {:0.2f}".format(df[x_variable].quantile(0.25))),
-                html.Li("Q3: {:0.2f}".format(df[x_variable].quantile(0.75))),
-                html.Li("IQR: {:0.2f}".format(df[x_variable].quantile(0.75) - df[x_variable].quantile(0.25))),
+    def summary_items(axis, variable):
+        return [html.H6("Summary statistics for" + transform_indicator_str + " {} variable: {}".format(axis, variable))] + \
+            [html.Li("{}: {:0.2f}".format(statistic, summary.at[variable, statistic]))
+             for statistic in SUMMARY_STATISTICS]
 
-                html.H6("Summary statistics for" + transform_indicator_str + " Y variable: {}".format(y_variable)),
-                html.Li("Minimum: {:0.2f}".format(df[y_variable].min())),
-                html.Li("Maximum: {:0.2f}".format(df[y_variable].max())),
-                html.Li("Mean: {:0.2f}".format(df[y_variable].mean())),
-                html.Li("Median: {:0.2f}".format(df[y_variable].median())),
-                html.Li("Skewness: {:0.2f}".format(df[y_variable].skew())),
-                html.Li("Kurtosis: {:0.2f}".format(df[y_variable].kurtosis())),
-                html.Li("Standard Deviation: {:0.2f}".format(df[y_variable].std())),
-                html.Li("Variance: {:0.2f}".format(df[y_variable].var())),
-                html.Li("Q1: {:0.2f}".format(df[y_variable].quantile(0.25))),
-                html.Li("Q3: {:0.2f}".format(df[y_variable].quantile(0.75))),
-                html.Li("IQR: {:0.2f}".format(df[y_variable].quantile(0.75) - df[y_variable].quantile(0.25)))]
-            )
-        ]
+    if x_variable is not None and is_numeric_dtype(df[x_variable]) and y_variable is not None and is_numeric_dtype(df[y_variable]):
+        items = summary_items('X', x_variable) + summary_items('Y', y_variable)
+        variables = [x_variable, y_variable]
     elif x_variable is not None and is_numeric_dtype(df[x_variable]):
-        return [
-            html.Ul(id='stats-list', children=[
-                html.H6("Summary statistics for" + transform_indicator_str + " X variable: {}".format(x_variable)),
-                html.Li("Minimum: {:0.2f}".format(df[x_variable].min())),
-                html.Li("Maximum: {:0.2f}".format(df[x_variable].max())),
-                html.Li("Mean: {:0.2f}".format(df[x_variable].mean())),
-                html.Li("Median: {:0.2f}".format(df[x_variable].median())),
-                html.Li("Skewness: {:0.2f}".format(df[x_variable].skew())),
-                html.Li("Kurtosis: {:0.2f}".format(df[x_variable].kurtosis())),
-                html.Li("Standard Deviation: {:0.2f}".format(df[x_variable].std())),
-                html.Li("Variance: {:0.2f}".format(df[x_variable].var())),
-                html.Li("Q1: {:0.2f}".format(df[x_variable].quantile(0.25))),
-                html.Li("Q3: {:0.2f}".format(df[x_variable].quantile(0.75))),
-                html.Li("IQR: {:0.2f}".format(df[x_variable].quantile(0.75) - df[x_variable].quantile(0.25)))]
-            )
-        ]
+        items = summary_items('X', x_variable)
+        variables = [x_variable]
     else:
         return html.H4("Error: None quantatative variable(s) selected for analysis with dropdowns")
 
+    return [
+        html.Ul(id='stats-list', children=items),
+        html.Details(id='describe-all', children=[
+            html.Summary("Describe all columns"),
+            dt.DataTable(
+                id='describe-all-table',
+                columns=[{'name': 'Variable', 'id': 'Variable'}] +
+                        [{'name': statistic, 'id': statistic} for statistic in SUMMARY_STATISTICS],
+                data=summary.round(2).rename_axis('Variable').reset_index().to_dict('records'),
+                fixed_columns={'headers': True, 'data': 1},
+                style_cell={'width': '150px'}
+            )
+        ])
+    ] + yearly_means(dashboard.filename, variables)
 
-@app.callback(Output('covar-corr', 'children'),
-    [Input('create-dashboard', 'n_clicks')],
-    [State('x-variable-dropdown', 'value'), State('y-variable-dropdown', 'value'),
-    State('files', 'value'), State('normalization-radio','value'),
-    State('transformation-radio', 'value'), State('countries', 'value'),
-    State('colour-dropdown', 'value')])
-def update_covariance_correlation(n_clicks,
-                        x_variable,
-                        y_variable,
-                        filename,
-                        normalization,
-                        transformation,
-                        countries,
-                        colour):
-    if n_clicks is None or y_variable is None:
-        raise PreventUpdate
 
-    df = pd.read_csv(os.path.join(DATASETS_PATH, filename))
-    validator = Validator([df])
-    df = validator.validate()
+def yearly_means(filename, variables):
+    """Mean of `variables` in each year of the multi-year panel, for the
+    yearly datasets only."""
+    if not panel.pattern.match(filename):
+        return []
+    frame = panel.refresh()
+    variables = [variable for variable in variables if frame is not None and variable in frame.columns]
+    if not variables:
+        return []
+
+    values = panel.slice(indicators=variables)[variables].apply(pd.to_numeric, errors='coerce')
+    means = values.groupby(level='year').mean().reindex(panel.years())
+    return [
+        html.Details(id='yearly-means', children=[
+            html.Summary("Mean of each year's dataset (untransformed)"),
+            dt.DataTable(
+                id='yearly-means-table',
+                columns=[{'name': 'Year', 'id': 'Year'}] +
+                        [{'name': variable, 'id': variable} for variable in variables],
+                data=means.round(2).rename_axis('Year').reset_index().to_dict('records'),
+                style_cell={'width': '150px'}
+            )
+        ])
+    ]
 
-    if normalization != 'None':
-        df = normalize(df, normalization)
-    if transformation != 'None':
-        df = power_transform(df)
 
-    fig = scatter_plot(df, x_variable, y_variable, countries, 'None', colour)
+# Correlation/covariance panel of the dashboard, see dashboardCallbacks.create_dashboard
+def covariance_correlation_panel(dashboard, x_variable, y_variable, countries, colour):
+    df = dashboard.validated_df
 
     if x_variable is not None and is_numeric_dtype(df[x_variable]) and y_variable is not None and is_numeric_dtype(df[y_variable]):
+        ols = dashboard.fit(x_variable, y_variable, 'ols')
+        fig = dashboard.figure(scatter_plot, x_variable, y_variable, countries, ols, colour, validated=True)
+        # coefficients are looked up from the dataset's precomputed matrices
+        correlations = dashboard.correlations
         return [
             html.Ul(id='covar-corr-list', children=[
                 html.H6("Correlation coefficients & Covariance for: {} and {}".format(x_variable, y_variable)),
-                html.Li("Pearson's correlation coefficient: {:0.2f}".format(df[x_variable].corr(df[y_variable], method='pearson'))),
-                html.Li("Spearman's correlation coefficient: {:0.2f}".format(df[x_variable].corr(df[y_variable], method='spearman'))),
-                html.Li("Kendall's correlation coefficient: {:0.2f}".format(df[x_variable].corr(df[y_variable], method='kendall'))),
-                html.Li("Pairwise covariance: {:0.2f}".format(df[x_variable].cov(df[y_variable])))
+                html.Li("Pearson's correlation coefficient: {:0.2f}".format(correlations['pearson'].at[x_variable, y_variable])),
+                html.Li("Spearman's correlation coefficient: {:0.2f}".format(correlations['spearman'].at[x_variable, y_variable])),
+                html.Li("Kendall's correlation coefficient: {:0.2f}".format(dashboard.kendall(x_variable, y_variable))),
+                html.Li("Pairwise covariance: {:0.2f}".format(correlations['covariance'].at[x_variable, y_variable])),
+                html.Li("OLS fit: slope {:0.4g}, R² {:0.2f}, p-value {:0.3g}".format(ols.slope, ols.r_squared, ols.p_value))
             ]),
-            dcc.Graph(id='corr-scatter-plot', figure = fig)
+            dcc.Graph(id='corr-scatter-plot', figure = fig),
+            html.Details(id='corr-heatmap-details', children=[
+                html.Summary("Correlation heat map of all variables"),
+                dcc.Graph(id='corr-heatmap', figure=correlation_heat_map(correlations['pearson'], colour))
+            ])
         ]
     else:
         return html.H4("Error: Non quantatative variable(s) selected for analysis with dropdowns")
@@ -240,24 +231,43 @@ def download_area(n_clicks, filename):
     if n_clicks is None:
         raise PreventUpdate
 
-    df = pd.read_csv(os.path.join(DATASETS_PATH, filename))
-    csv_string = df.to_csv(index=False, encoding='utf-8')
-    csv_string = "data:text/csv;charset=utf-8,%EF%BB%BF" + quote(csv_string)
+    columns = cached_dataset(filename).columns
 
+    # rows are fetched a page at a time by preview_table_page, the file itself from download.download
     return [
+        dcc.Store(id='download-preview-file', data=filename),
         dt.DataTable(
             id='download-preview-table',
-            columns=[{'name': i, 'id': i} for i in df.columns],
-            data=df.to_dict('records'),
+            columns=[{'name': i, 'id': i} for i in columns],
+            page_action='custom',
+            page_current=0,
+            page_size=PREVIEW_PAGE_SIZE,
+            sort_action='custom',
+            sort_mode='multi',
+            sort_by=[],
+            filter_action='custom',
+            filter_query='',
             fixed_columns={'headers': True, 'data': 1},
-            fixed_rows={ 'headers': True, 'data': 5},
+            fixed_rows={ 'headers': True, 'data': 0},
             style_cell={'width': '150px'}
         ),
         html.A(
             'Download Dataset',
             id='download-link',
             download=filename,
-            href=csv_string,
+            href='/download/' + quote(filename),
             target="_blank"
         )
     ]
+
+
+@app.callback([Output('download-preview-table', 'data'),
+    Output('download-preview-table', 'page_count')],
+    [Input('download-preview-table', 'page_current'), Input('download-preview-table', 'page_size'),
+    Input('download-preview-table', 'filter_query'), Input('download-preview-table', 'sort_by')],
+    [State('download-preview-file', 'data')])
+def preview_table_page(page_current, page_size, filter_query, sort_by, filename):
+    if filename is None:
+        raise PreventUpdate
+
+    return preview_page(filename, page_current or 0, page_size or PREVIEW_PAGE_SIZE, filter_query, sort_by)
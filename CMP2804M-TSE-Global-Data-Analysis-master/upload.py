@@ -0,0 +1,208 @@
+import base64
+import binascii
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+import numpy as np
+import pandas as pd
+from flask import jsonify, request
+from werkzeug.utils import secure_filename
+from app import app, BACKGROUND_JOBS, DATASETS_PATH, UPLOAD_PATH, UPLOAD_MAX_BYTES, UPLOAD_CHUNK_BYTES, \
+    UPLOAD_PARSE_ROWS
+from catalog import frame_summary, register
+from columnar import write_sidecar
+from helpers import dataset_key, invalidate_dataset
+from validator import MissingLocationColumns, Validator
+import jobs
+
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+# progress of finished uploads and abandoned part files are removed after this
+UPLOAD_EXPIRY_S = 24 * 60 * 60
+
+
+class UploadError(Exception):
+    """An upload that was rejected, with the HTTP status to report."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# Progress is kept in a small JSON file per upload, so any worker can answer
+# the polling requests for an upload another worker is receiving.
+def progress_path(upload_id):
+    return os.path.join(UPLOAD_PATH, '{}.json'.format(upload_id))
+
+
+def report(upload_id, **progress):
+    if upload_id is None:
+        return
+    progress['updated'] = time.time()
+    os.makedirs(UPLOAD_PATH, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=UPLOAD_PATH, suffix='.json.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as file:
+        json.dump(progress, file)
+    os.replace(tmp, progress_path(upload_id))
+
+
+def read_progress(upload_id):
+    try:
+        with open(progress_path(upload_id), encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def prune():
+    cutoff = time.time() - UPLOAD_EXPIRY_S
+    for name in os.listdir(UPLOAD_PATH):
+        path = os.path.join(UPLOAD_PATH, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.unlink(path)
+        except OSError:
+            pass
+
+
+def dataset_filename(filename):
+    filename = secure_filename(filename or '')
+    if not filename.endswith('.csv'):
+        raise UploadError("Incompatible filetype. Please upload a .csv file.")
+    if os.path.exists(os.path.join(DATASETS_PATH, filename)):
+        raise UploadError("File already exists on disk. Please change filename.", 409)
+    return filename
+
+
+def receive(stream, upload_id=None, length=None):
+    """Copy `stream` into a part file UPLOAD_CHUNK_BYTES at a time and return
+    its path. Only one chunk is ever held in memory."""
+    if length is not None and length > UPLOAD_MAX_BYTES:
+        raise UploadError("File is larger than the {:,} byte limit.".format(UPLOAD_MAX_BYTES), 413)
+
+    os.makedirs(UPLOAD_PATH, exist_ok=True)
+    prune()
+    fd, part = tempfile.mkstemp(dir=UPLOAD_PATH, suffix='.part')
+    received = 0
+    last_report = 0
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                received += len(chunk)
+                if received > UPLOAD_MAX_BYTES:
+                    raise UploadError("File is larger than the {:,} byte limit.".format(UPLOAD_MAX_BYTES), 413)
+                file.write(chunk)
+                if time.time() - last_report > 0.5:
+                    report(upload_id, state='receiving', received=received, total=length)
+                    last_report = time.time()
+    except Exception:
+        os.unlink(part)
+        raise
+
+    report(upload_id, state='received', received=received, total=length)
+    return part
+
+
+def checked_chunks(part, upload_id=None):
+    """The CSV at `part` UPLOAD_PARSE_ROWS rows at a time. The first chunk
+    must have location and year columns for the validator."""
+    rows = 0
+    for idx, chunk in enumerate(pd.read_csv(part, chunksize=UPLOAD_PARSE_ROWS)):
+        if idx == 0:
+            try:
+                Validator([chunk]).build_collated_df()
+            except MissingLocationColumns:
+                raise UploadError("No country and year columns found in the uploaded file.")
+        rows += len(chunk)
+        report(upload_id, state='parsing', rows=rows)
+        yield chunk
+
+
+def build_sidecar(path, key, dtypes, progress=None):
+    # runs in the jobs pool, so the whole file is never parsed in a web
+    # worker; `key` only identifies the job, see jobs.submit
+    write_sidecar(path, pd.read_csv(path, dtype=dtypes))
+
+
+def ingest(part, filename, upload_id=None):
+    """Check the CSV at `part` a chunk at a time, then publish it as a dataset.
+
+    Its catalog entry is built from the same chunks. Column dtypes are
+    inferred across all of them, so the one full parse made for the columnar
+    copy (in the jobs pool with BACKGROUND_JOBS) gets the same types
+    throughout. Returns (rows, columns)."""
+    try:
+        try:
+            summary = frame_summary(checked_chunks(part, upload_id))
+        except (ValueError, UnicodeDecodeError) as error:
+            raise UploadError("Unable to parse the uploaded file as CSV: {}".format(error))
+
+        path = os.path.join(DATASETS_PATH, filename)
+        # unlike a check then a rename, linking fails if an upload racing
+        # this one has taken the name in between
+        try:
+            os.link(part, path)
+        except FileExistsError:
+            raise UploadError("File already exists on disk. Please change filename.", 409)
+        os.unlink(part)
+    except Exception:
+        if os.path.exists(part):
+            os.unlink(part)
+        raise
+
+    invalidate_dataset(filename)
+    register(filename, summary=summary)
+    dtypes = {column: np.dtype(dtype) for column, dtype in summary['dtypes'].items()}
+    if BACKGROUND_JOBS:
+        jobs.submit(build_sidecar, path, dataset_key(filename), dtypes)
+    else:
+        build_sidecar(path, None, dtypes)
+    report(upload_id, state='done', rows=summary['rows'], filename=filename)
+    return summary['rows'], len(summary['columns'])
+
+
+def save_contents(contents, filename):
+    """dcc.Upload's data URI, decoded straight into a part file and ingested."""
+    filename = dataset_filename(filename)
+    os.makedirs(UPLOAD_PATH, exist_ok=True)
+    fd, part = tempfile.mkstemp(dir=UPLOAD_PATH, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(base64.b64decode(contents[contents.index(',') + 1:]))
+    except (ValueError, binascii.Error):
+        os.unlink(part)
+        raise UploadError("Incompatible filetype. Please upload a .csv file.")
+    return ingest(part, filename)
+
+
+@app.server.route('/upload/<filename>', methods=['POST', 'PUT'])
+def upload(filename):
+    """Stream a CSV in the request body into the datasets directory.
+
+    Pass ?id=<32 hex digits> to follow progress at /upload/progress/<id>."""
+    upload_id = request.args.get('id') or uuid.uuid4().hex
+    if not UPLOAD_ID_RE.match(upload_id):
+        return jsonify(error="Upload id must be 32 hex digits."), 400
+
+    try:
+        filename = dataset_filename(filename)
+        part = receive(request.stream, upload_id, request.content_length)
+        rows, columns = ingest(part, filename, upload_id)
+    except UploadError as error:
+        report(upload_id, state='failed', error=str(error))
+        return jsonify(id=upload_id, error=str(error)), error.status
+
+    return jsonify(id=upload_id, filename=filename, rows=rows, columns=columns), 201
+
+
+@app.server.route('/upload/progress/<upload_id>')
+def upload_progress(upload_id):
+    progress = read_progress(upload_id) if UPLOAD_ID_RE.match(upload_id) else None
+    if progress is None:
+        return jsonify(error="Unknown upload."), 404
+    return jsonify(progress)
@@ -1,253 +1,380 @@
-from collections import namedtuple
+import os
+import sqlite3
+from collections import Counter, namedtuple
+from functools import lru_cache
 from json import load
-from re import search, match
-from time import time
+from re import compile
+from threading import Lock
 
+from numpy import append, arange, nan, repeat
 from pandas import read_csv
-from pandas import DataFrame
+from pandas import concat, factorize
+from pandas import DataFrame, Series
 
 YEAR_MATCHES = ("year", "time", "yr")
 COUNTRY_MATCHES = ("country", "alpha", "iso", "m49", "name")
 
 Country = namedtuple("Country", ["name", "a2", "a3", "m49"])
 
-with open("./assets/countries.json", encoding="utf-8") as file:
-	country_data = load(file)
 
+class MissingLocationColumns(ValueError):
+	"""The datasets have no country column or no year column to validate by."""
 
-class Validator(object):
-	def __init__(self, dfs, lang="gb"):
-		if not isinstance(dfs, list) and not isinstance(dfs, tuple):
-			raise TypeError("`Validator` takes a list or tuple of DataFrame objects.")
+INVALID = "[invalid]"
 
-		for df in dfs:
-			if not isinstance(df, DataFrame):
-				raise TypeError("`Validator` takes a list or tuple of DataFrame objects.")
-		
-		self.dfs = dfs
+BASE_PATH = os.path.dirname(os.path.abspath(__file__))
+COUNTRIES_PATH = os.path.join(BASE_PATH, "assets", "countries.json")
+COUNTRY_INDEX_PATH = os.path.join(BASE_PATH, "assets", "countries.index.json")
+LOCATION_DB_PATH = os.path.join(BASE_PATH, "cache-directory", "locations.sqlite3")
 
-		if lang not in ("gb", "us"):
-			raise ValueError("`lang` parameter needs to be either 'gb' or 'us'.")
+_country_index = None
 
-		self.lang = lang
-		self.latest = 0
 
-	def tokenise_columns(self):
-		punc = "!\"#&'()*+,./:;<=>?@[\\]^_`{|}~"
-		max_cols = 0
-		tokens = []
-		translations = load(open(f"./assets/{'us-gb' if self.lang == 'gb' else 'gb-us'}.json", "r"))
+def load_country_index():
+	"""Loads the lookup compiled by assets/CsvToJson.py, rebuilding it if it
+	was built from a different countries.json."""
+	from assets.CsvToJson import build_index, file_digest, write_index
 
-		def translate(column):
-			column = column.split(" ")
-			col = ""
-			spl = []
+	source = file_digest(COUNTRIES_PATH)
 
-			for idx, word in enumerate(column):
-				p = ""
+	try:
+		with open(COUNTRY_INDEX_PATH, encoding="utf-8") as file:
+			index = load(file)
 
-				for char in word:
-					if char in punc:
-						p += char
-						word = word.replace(char, "")
+		if index["source"] == source:
+			return index
 
-				if word.lower() in translations.keys():
-					if idx == 0:
-						word = translations[word.lower()].title()
+	except (OSError, ValueError, KeyError):
+		pass
 
-					else:
-						word = translations[word]
+	with open(COUNTRIES_PATH, encoding="utf-8") as file:
+		index = build_index(load(file), source)
 
-				try:
-					word = f"{int(word):,}"
-					p = p.replace(",", "")
-					# spl.append(f"{int(word):,}")
-					# col += f"{int(word):,} "
+	try:
+		write_index(index, COUNTRY_INDEX_PATH)
 
-				except ValueError:
-					pass
+	except OSError:
+		pass
 
-				spl.append(word)
+	return index
 
-				if len(p) > 0 and p[0] == "(":
-					col += f"{p[0]}{word}{p[1:]} "
 
-				else:
-					col += f"{word}{p} "
+def get_country_index():
+	global _country_index
 
-			return col.strip()
+	# loaded on first use rather than on import
+	if _country_index is None:
+		_country_index = load_country_index()
 
-		def split(phrase):
-			for char in punc:
-				phrase = phrase.replace(char, "")
+	return _country_index
 
-			return phrase.split(" ")
 
-		def tokenise(column):
-			# print(column)
-			column = translate(column)
-			# print(column)
-			item = {
-				"raw": [column],
-				"tokens": [],
-				"combos": [],
-				"context": None,
-				"unit": None,
-			}
+def resolve_location(stored):
+	"""Returns what `stored` should be for unification, or INVALID."""
+	if not isinstance(stored, str):
+		return INVALID
 
-			if (match := search(r'\(.*\)', column)) is not None:
-				# print(column)
-				# print(match)
-				item["unit"] = match.group()[1:-1]
-				column = column[:match.span()[0]-1]
+	index = get_country_index()
+	matches = [m for m in (index["lowered"].get(stored.lower()), index["exact"].get(stored)) if m is not None]
 
-			if len(column.split(",")) > 1:
-				item["context"] = (ctx := column.split(",")[-1].strip())
-				column = column.replace(f", {ctx}", "")
+	if not matches:
+		return INVALID
 
-			for idx, word in enumerate((spl := split(column))): # split has to be done twice
-				if word in ("and", "of"):
-					item["combos"].append(f"{spl[idx-1]} {spl[idx]} {spl[idx+1]}")
+	result = min(matches)[2]
+	return stored if result is None else result
 
-				else:
-					item["tokens"].append(word)
 
-			return item
+def find_column(columns, matches):
+	"""The first of `columns` with a word from `matches` in its header, or None."""
+	return next((c for c in columns if any([kw in str(c).lower().split(" ") for kw in matches])), None)
 
-		for df in self.dfs:
-			if len(df.columns) > max_cols:
-				max_cols = len(df.columns)
 
-			for column in df.columns:
-				tokens.append(tokenise(column))
+ColumnTokens = namedtuple("ColumnTokens", ["raw", "tokens", "unit", "context", "code"])
 
-		# for item in tokens:
-		# 	for key, value in item.items():
-		# 		print(f"{key}: {value}")
+CODE_RE = compile(r"\[([^\]]*)\]")
+PARENS_RE = compile(r"\(([^()]*)\)")
+THOUSANDS_RE = compile(r"(?<=\d),(?=\d{3})")
+WORD_RE = compile(r"[a-z0-9%$]+")
+STOPWORDS = frozenset(("and", "of", "the", "in"))
+MATCH_THRESHOLD = 0.6
 
-		# 	print()
 
-		# 	print()
+@lru_cache(maxsize=None)
+def load_translations(lang):
+	"""us-gb (or gb-us) spellings, empty if the translation file isn't there."""
+	path = os.path.join(BASE_PATH, "assets", f"{'us-gb' if lang == 'gb' else 'gb-us'}.json")
 
-	def build_collated_df(self):
-		punc = "!\"#&'()*+,-./:;<=>?@[\\]^_`{|}~"
-		col_tokens = []
-		df_cols = []
+	try:
+		with open(path, encoding="utf-8") as file:
+			return {key.lower(): value.lower() for key, value in load(file).items()}
 
-		for df in self.dfs:
-			if len(df.columns) > len(df_cols):
-				df_cols = list(df.columns)
+	except (OSError, ValueError):
+		return {}
 
-			for column in df.columns:
-				for char in punc:
-					column = column.replace(char, "")
 
-				col_tokens.append((df, column.split(" ")))
+@lru_cache(maxsize=4096)
+def tokenise_column(column, lang="gb"):
+	"""Splits a header such as "Mortality rate, under-5 (per 1,000 live births)"
+	into its words plus the unit in brackets, the context after the last comma
+	and any [indicator code]."""
+	translations = load_translations(lang)
 
-		# for ct in col_tokens:
-		# 	print(ct[1])
+	code = CODE_RE.search(column)
+	text = THOUSANDS_RE.sub("", CODE_RE.sub("", column)).strip()
+	units = PARENS_RE.findall(text)
+	parts = PARENS_RE.sub(" ", text).split(",")
 
-		#XX test stuff + beta. Not run in alpha
-		# self.tokenise_columns()
-		# quit()
+	words = [translations.get(word, word) for word in WORD_RE.findall(text.lower())]
 
-		self.country_column = next((c for c in df_cols if any([kw in c.lower().split(" ") for kw in COUNTRY_MATCHES])))
-		self.year_column = next((c for c in df_cols if any([kw in c.lower().split(" ") for kw in YEAR_MATCHES])))
+	return ColumnTokens(
+		raw=column,
+		tokens=frozenset(word for word in words if word not in STOPWORDS),
+		unit=" ".join(WORD_RE.findall(units[-1].lower())) if units else None,
+		context=parts[-1].strip().lower() if len(parts) > 1 else None,
+		code=code.group(1).strip() if code is not None else None,
+	)
 
-		cols = ["Dataset Index", "Data Year"]
-		extras = len(cols)
-		cols.extend(df_cols)
-		data = {col: [] for col in cols}
-		most = 0
 
-		def determine_year(cols, row):
-			if (result := search(r'[0-9]{4}', row[1][self.year_column])) is not None:
-				return result.group()
+def match_score(a, b, shared):
+	"""Similarity of two tokenised headers sharing `shared` tokens."""
+	if a.code is not None and b.code is not None:
+		return 1.0 if a.code == b.code else 0.0
 
-		for idx, df in enumerate(self.dfs):
-			for row in df.iterrows():
-				data["Dataset Index"].append(idx)
-				data["Data Year"].append(determine_year(cols, row))
+	# same words in different units are different indicators
+	if a.unit is not None and b.unit is not None and a.unit != b.unit:
+		return 0.0
 
-				for idx2, col in enumerate(cols):
-					if idx2 >= extras:
-						try:
-							data[col].append(row[1][idx2-extras])
+	return shared / len(a.tokens | b.tokens)
 
-						except IndexError:
-							pass		
 
-		return DataFrame(data, columns=cols)
+@lru_cache(maxsize=256)
+def align_columns(reference, columns, lang="gb"):
+	"""Pairs headers in `columns` with equivalent headers in `reference`.
 
-	def validate(self):
-		start = time()
+	Both are tuples. Identical headers pair up first; the rest are only scored
+	against reference headers they share a token with, found through an
+	inverted index, and paired best-first. Returns a tuple of
+	(column, reference column) pairs."""
+	pairs = {column: column for column in columns if column in set(reference)}
+	taken = set(pairs.values())
 
-		# build a collated df using data from all datasets
-		cdf = self.build_collated_df()
+	remaining = {ref: tokenise_column(str(ref), lang) for ref in reference if ref not in taken}
+	inverted = {}
 
-		# do all the validation here
-		cdf = self.unify_locations(cdf)
+	for ref, item in remaining.items():
+		for token in item.tokens:
+			inverted.setdefault(token, []).append(ref)
 
-		# output
-		print(f"\nValidation took {time()-start:,.3f} secs.")
+		if item.code is not None:
+			inverted.setdefault(f"[{item.code}]", []).append(ref)
 
-		# test stuff
-		# print(cdf.columns)
+	candidates = []
 
-		return cdf
+	for column in columns:
+		if column in pairs:
+			continue
 
-	def unify_locations(self, df):
-		to_replace = []
-		value = []
+		item = tokenise_column(str(column), lang)
+		shared = Counter(ref for token in item.tokens for ref in inverted.get(token, ()))
+
+		if item.code is not None:
+			shared.update(inverted.get(f"[{item.code}]", ()))
+
+		for ref, count in shared.items():
+			if (score := match_score(item, remaining[ref], count)) >= MATCH_THRESHOLD:
+				candidates.append((score, str(column), str(ref), column, ref))
+
+	for _, _, _, column, ref in sorted(candidates, reverse=True):
+		if column not in pairs and ref not in taken:
+			pairs[column] = ref
+			taken.add(ref)
+
+	return tuple((column, pairs[column]) for column in columns if column in pairs)
+
+
+class LocationStore(object):
+	"""Resolved location strings, persisted in sqlite so every worker shares them.
+
+	The table is warmed with every spelling in the country index and tagged with
+	the digest of countries.json it was built from; editing the gazetteer starts
+	it afresh."""
+
+	MEMO_LIMIT = 100000
+
+	def __init__(self, path):
+		self.path = path
+		self.memo = {}
+		self._conn = None
+		self._pid = None
+		self._lock = Lock()
+
+	def _connect(self):
+		# connections can't be carried over into forked workers
+		if self._conn is not None and self._pid == os.getpid():
+			return self._conn
+
+		os.makedirs(os.path.dirname(self.path), exist_ok=True)
+		conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+		conn.execute("PRAGMA journal_mode=WAL")
+		conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+		conn.execute("CREATE TABLE IF NOT EXISTS locations (raw TEXT PRIMARY KEY, resolved TEXT NOT NULL)")
+
+		index = get_country_index()
+		row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+		if row is None or row[0] != index["source"]:
+			with conn:
+				conn.execute("DELETE FROM locations")
+				conn.executemany("INSERT OR REPLACE INTO locations VALUES (?, ?)",
+					((raw, resolve_location(raw)) for raw in list(index["lowered"]) + list(index["exact"])))
+				conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (index["source"],))
+
+		self._conn, self._pid = conn, os.getpid()
+		return conn
+
+	def _fetch(self, raws):
+		found = {}
+
+		with self._lock:
+			conn = self._connect()
+			# stay under sqlite's limit on bound parameters
+			for start in range(0, len(raws), 500):
+				chunk = raws[start:start+500]
+				query = f"SELECT raw, resolved FROM locations WHERE raw IN ({','.join('?' * len(chunk))})"
+				found.update(conn.execute(query, chunk))
+
+		return found
+
+	def _store(self, resolved):
+		with self._lock:
+			conn = self._connect()
+			with conn:
+				conn.executemany("INSERT OR IGNORE INTO locations VALUES (?, ?)", resolved.items())
+
+	def resolve_many(self, values):
+		"""Returns {value: unified location or INVALID} for each of `values`."""
+		result = {}
+		missing = []
 
-		def identify(stored):
-			"""Checks if `stored` is valid.
-			Returns what the country should be for unification.:
-			Key: name (preceding)."""
+		for value in values:
+			if value in self.memo:
+				result[value] = self.memo[value]
 
-			for c in country_data:
-				if stored.lower() == c["country"].lower():
-					return stored
+			elif isinstance(value, str):
+				missing.append(value)
 
-				#XX might be changed to include `.lower()` at some point
-				elif stored in (c["a2"], c["a3"], c["m49"]):
-					return c["country"]
+			else:
+				result[value] = INVALID
 
-				elif (has_pre := "preceding" in c.keys()):
-					if stored.lower() == f"{c['country']} ({c['preceding']})":
-						return stored
+		if missing:
+			try:
+				found = self._fetch(missing)
+			except sqlite3.Error:
+				found = {}
+
+			new = {raw: resolve_location(raw) for raw in missing if raw not in found}
 
-					elif stored.lower() == f"{c['preceding']} {c['country']}":
-						return f"{c['country']} ({c['preceding']})"
+			if new:
+				try:
+					self._store(new)
+				except sqlite3.Error:
+					pass
+
+			found.update(new)
+
+			if len(self.memo) > self.MEMO_LIMIT:
+				self.memo.clear()
+
+			self.memo.update(found)
+			result.update(found)
+
+		return result
+
+
+location_store = LocationStore(LOCATION_DB_PATH)
+
+
+class Validator(object):
+	def __init__(self, dfs, lang="gb"):
+		if not isinstance(dfs, list) and not isinstance(dfs, tuple):
+			raise TypeError("`Validator` takes a list or tuple of DataFrame objects.")
+
+		for df in dfs:
+			if not isinstance(df, DataFrame):
+				raise TypeError("`Validator` takes a list or tuple of DataFrame objects.")
+		
+		self.dfs = dfs
+
+		if lang not in ("gb", "us"):
+			raise ValueError("`lang` parameter needs to be either 'gb' or 'us'.")
 
-				elif "aka" in c.keys() and stored.lower() in c["aka"]:
-					return f"{c['country']} ({c['preceding']})" if has_pre else c["country"]
+		self.lang = lang
+		self.latest = 0
+
+	def tokenise_columns(self):
+		"""Returns the tokenised headers of each DataFrame."""
+		return [[tokenise_column(str(column), self.lang) for column in df.columns] for df in self.dfs]
+
+	def match_columns(self):
+		"""Aligns every DataFrame's headers with those of the widest one.
+
+		Returns the reference headers and, for each DataFrame, a dict mapping
+		its columns onto their equivalent reference column."""
+		reference = []
 
-			return "[invalid]"
+		for df in self.dfs:
+			if len(df.columns) > len(reference):
+				reference = list(df.columns)
+
+		alignments = [dict(align_columns(tuple(reference), tuple(df.columns), self.lang)) for df in self.dfs]
+		return reference, alignments
 
-		def title(phrase):
-			parts = []
+	def build_collated_df(self):
+		df_cols, alignments = self.match_columns()
 
-			for word in phrase.split(" "):
-				if word not in ("and", "of"):
-					parts.append(word.title())
+		self.country_column = find_column(df_cols, COUNTRY_MATCHES)
+		self.year_column = find_column(df_cols, YEAR_MATCHES)
 
-				else:
-					parts.append(word)
+		if self.country_column is None or self.year_column is None:
+			raise MissingLocationColumns("No country and year columns found in the dataset.")
 
-			return " ".join(parts)
+		frames = []
 
-		for idx, row in enumerate(df.iterrows()):
-			stored = row[1][self.country_column]
+		for df, alignment in zip(self.dfs, alignments):
+			# equivalent columns take the widest DataFrame's headers
+			frame = df[list(alignment)]
+			frame.columns = list(alignment.values())
+			frames.append(frame)
 
-			if (ret := identify(stored)) == "[invalid]":
-				df.drop(index=idx, inplace=True)
+		cdf = concat(frames, ignore_index=True, sort=False).reindex(columns=df_cols)
+		# the year column repeats a handful of values, so only extract from those
+		codes, uniques = factorize(cdf[self.year_column])
+		years = Series(uniques).astype(str).str.extract(r'([0-9]{4})', expand=False)
+		cdf.insert(0, "Data Year", append(years.to_numpy(), nan)[codes])
+		cdf.insert(0, "Dataset Index", repeat(arange(len(frames)), [len(frame) for frame in frames]))
 
-			elif ret != stored:
-				to_replace.append(stored)
-				value.append(ret)
+		return cdf
 
-		df[self.country_column].replace(to_replace, value, inplace=True)
+	def validate(self):
+		# build a collated df using data from all datasets
+		cdf = self.build_collated_df()
+
+		# do all the validation here
+		cdf = self.unify_locations(cdf)
+
+		# test stuff
+		# print(cdf.columns)
+
+		return cdf
+
+	def unify_locations(self, df):
+		column = df[self.country_column]
+		# resolve each distinct location once, then apply to every row at once
+		resolved = location_store.resolve_many(column.unique())
+		unified = column.map(resolved).fillna(INVALID)
+		valid = unified != INVALID
+
+		df = df[valid].copy()
+		df[self.country_column] = unified[valid]
 		return df
 
 